@@ -0,0 +1,223 @@
+"""
+Benchmark installing a package from an HTTP URL against downloading it first.
+
+    python benchmarks/bench_http_install.py --size 256M --rate 50M
+
+A local `http.server` with Range support stands in for the package server;
+`--rate` throttles each connection to simulate a network link. Three cases
+are timed on the same package:
+- download: fetching the whole file, the floor for any install,
+- download_then_install: saving the file, then `install_uspkg`,
+- install_from_url: `install_uspkg_from_url`, which overlaps the two.
+The bytes the server sent are counted per case, so downloading parts of the
+package more than once shows up as `served_over_package` above 1. The
+installed trees are compared with the source tree, and the script exits
+with status 1 if they differ.
+"""
+import argparse
+import filecmp
+import functools
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "src")
+sys.path.insert(0, BENCHMARKS_DIR)
+if os.path.isdir(SRC_DIR):
+    sys.path.insert(0, SRC_DIR)
+
+from generate import generate_tree, parse_size
+
+SEND_CHUNK_SIZE = 64 * 1024
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files with keep-alive and single Range requests ("bytes=a-b", "bytes=a-", "bytes=-n")."""
+
+    protocol_version = "HTTP/1.1"
+    rate = None
+    served = None
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, "File not found")
+            return None
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if not match.group(1):
+                start = max(0, size - int(match.group(2)))
+            else:
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            if start > end:
+                self.send_error(416, "Requested Range Not Satisfiable")
+                return None
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+        f = open(path, 'rb')
+        f.seek(start)
+        self._remaining = end - start + 1
+        return f
+
+    def copyfile(self, source, outputfile):
+        started = time.perf_counter()
+        sent = 0
+        while self._remaining:
+            block = source.read(min(SEND_CHUNK_SIZE, self._remaining))
+            if not block:
+                break
+            outputfile.write(block)
+            self.served.add(len(block))
+            self._remaining -= len(block)
+            sent += len(block)
+            if self.rate:
+                delay = sent / self.rate - (time.perf_counter() - started)
+                if delay > 0:
+                    time.sleep(delay)
+
+    def log_message(self, format, *args):
+        pass
+
+class ByteCounter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def add(self, count):
+        with self._lock:
+            self.value += count
+
+    def take(self):
+        with self._lock:
+            value, self.value = self.value, 0
+        return value
+
+def serve(directory, rate=None):
+    """
+    Serve `directory` on a free local port in a background thread.
+
+    Returns the server; its `served` counter holds the bytes sent so far.
+    """
+    served = ByteCounter()
+    handler = type("Handler", (RangeRequestHandler,), {"rate": rate, "served": served})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(handler, directory=directory))
+    server.daemon_threads = True
+    server.served = served
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def make_package(work_dir, size, seed):
+    import uspkg
+    from PIL import Image
+
+    tree_dir = os.path.join(work_dir, "tree")
+    generate_tree(tree_dir, size, seed)
+    image_path = os.path.join(work_dir, "cover.png")
+    Image.new("RGB", (640, 480), (40, 90, 160)).save(image_path)
+    served_dir = os.path.join(work_dir, "served")
+    os.makedirs(served_dir)
+    package = os.path.join(served_dir, "package.uspkg")
+    uspkg.create_encrypted_uspkg_with_uid(tree_dir, package, "Benchmark", "Synthetic package", image_path, "Fan Game", "main.exe")
+    return tree_dir, package
+
+def same_tree(left, right):
+    comparison = filecmp.dircmp(left, right)
+    if comparison.left_only or comparison.right_only or comparison.funny_files:
+        return False
+    _, mismatch, errors = filecmp.cmpfiles(left, right, comparison.common_files, shallow=False)
+    return not mismatch and not errors and all(same_tree(os.path.join(left, d), os.path.join(right, d)) for d in comparison.common_dirs)
+
+def download(url, path):
+    with urllib.request.urlopen(url) as response, open(path, 'wb') as f:
+        shutil.copyfileobj(response, f, 1024 * 1024)
+
+def run_cases(url, served, work_dir, tree_dir, workers, connections):
+    """Run the three cases. Returns their seconds, the bytes served for each and the cases whose tree is wrong."""
+    import uspkg
+
+    downloaded = os.path.join(work_dir, "downloaded.uspkg")
+    results = {}
+    served_bytes = {}
+    installed = {}
+    served.take()
+
+    start = time.perf_counter()
+    download(url, downloaded)
+    results["download"] = time.perf_counter() - start
+    served_bytes["download"] = served.take()
+    os.remove(downloaded)
+
+    start = time.perf_counter()
+    download(url, downloaded)
+    installed["download_then_install"] = os.path.join(work_dir, "installed-local")
+    uspkg.install_uspkg(downloaded, installed["download_then_install"], workers=workers)
+    results["download_then_install"] = time.perf_counter() - start
+    served_bytes["download_then_install"] = served.take()
+
+    start = time.perf_counter()
+    installed["install_from_url"] = os.path.join(work_dir, "installed-url")
+    uspkg.install_uspkg_from_url(url, installed["install_from_url"], workers=workers, connections=connections)
+    results["install_from_url"] = time.perf_counter() - start
+    served_bytes["install_from_url"] = served.take()
+
+    mismatches = [name for name, path in installed.items() if not same_tree(tree_dir, path)]
+    return results, served_bytes, mismatches
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark installing a .uspkg package from an HTTP URL.")
+    parser.add_argument("--size", default="64M", help="Size of the synthetic tree, e.g. 64M or 1G")
+    parser.add_argument("--rate", default=None, help="Bandwidth limit per connection, e.g. 50M (bytes per second)")
+    parser.add_argument("--workers", type=int, default=None, help="Install threads (both install cases)")
+    parser.add_argument("--connections", type=int, default=4, help="HTTP connections used by install_from_url")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic tree")
+    parser.add_argument("--output", "-o", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="uspkg-http-") as work_dir:
+        tree_dir, package = make_package(work_dir, parse_size(args.size), args.seed)
+        server = serve(os.path.dirname(package), parse_size(args.rate) if args.rate else None)
+        try:
+            url = f"http://127.0.0.1:{server.server_address[1]}/{os.path.basename(package)}"
+            timings, served_bytes, mismatches = run_cases(url, server.served, work_dir, tree_dir, args.workers, args.connections)
+        finally:
+            server.shutdown()
+            server.server_close()
+        package_bytes = os.path.getsize(package)
+
+    results = {
+        "size": args.size,
+        "package_bytes": package_bytes,
+        "rate": args.rate,
+        "connections": args.connections,
+        "seconds": {name: round(seconds, 3) for name, seconds in timings.items()},
+        "install_over_download": round(timings["install_from_url"] / timings["download"], 2),
+        "served_over_package": {name: round(count / package_bytes, 3) for name, count in served_bytes.items()},
+    }
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    for name in mismatches:
+        print(f"MISMATCH {name} does not match the source tree", file=sys.stderr)
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
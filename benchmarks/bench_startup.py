@@ -0,0 +1,131 @@
+"""
+Startup-time benchmark for `import uspkg` and the CLI.
+
+    python benchmarks/bench_startup.py --runs 20 --max-ms 150
+
+Each case runs in a fresh interpreter. The time of an empty interpreter is
+measured the same way and subtracted, so the numbers are the cost of uspkg
+itself. Exits with status 1 if a case exceeds `--max-ms`, or if a case loads
+a module it must not (e.g. `info` importing cryptography). Modules that the
+empty interpreter already loads, for instance from site hooks, are not
+counted against uspkg.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "src")
+
+HEAVY_MODULES = ("cryptography", "PIL", "term_image", "colorama", "zipfile", "sqlite3", "concurrent.futures")
+
+# name: (code run in the child, modules it must not load)
+CASES = {
+    "python": ("pass", ()),
+    "import": ("import uspkg", HEAVY_MODULES),
+    "cli_help": ("run_cli('--help')", HEAVY_MODULES),
+    "cli_info_json": ("run_cli('info', PACKAGE, '--json')", HEAVY_MODULES),
+    "read_trailer": ("import uspkg; uspkg.read_uspkg_trailer(PACKAGE)", HEAVY_MODULES),
+}
+
+CHILD_TEMPLATE = """
+import contextlib, io, json, sys
+PACKAGE = {package!r}
+
+def run_cli(*argv):
+    from uspkg.uspkg_cli import main
+    sys.argv = ["uspkg-cli", *argv]
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            main()
+        except SystemExit:
+            pass
+
+{code}
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps(heavy))
+"""
+
+def make_package(work_dir):
+    """Create a small package to read, with the full library (outside of the timed runs)."""
+    sys.path.insert(0, SRC_DIR)
+    import uspkg
+    from PIL import Image
+
+    tree = os.path.join(work_dir, "tree")
+    os.makedirs(tree)
+    with open(os.path.join(tree, "main.exe"), "wb") as f:
+        f.write(os.urandom(64 * 1024))
+    image_path = os.path.join(work_dir, "cover.png")
+    Image.new("RGB", (640, 480), (40, 90, 160)).save(image_path)
+    package = os.path.join(work_dir, "startup.uspkg")
+    uspkg.create_encrypted_uspkg_with_uid(tree, package, "Startup", "Startup benchmark", image_path, "Fan Game", "main.exe")
+    return package
+
+def run_case(code, package):
+    """Run `code` in a fresh interpreter. Returns the wall time and the heavy modules it loaded."""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SRC_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    child = CHILD_TEMPLATE.format(package=package, code=code, heavy=HEAVY_MODULES)
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", child], check=True, stdout=subprocess.PIPE, env=env, universal_newlines=True)
+    seconds = time.perf_counter() - start
+    return seconds, json.loads(completed.stdout.strip().splitlines()[-1])
+
+def run_suite(runs, package):
+    results = {}
+    for name, (code, forbidden) in CASES.items():
+        timings = []
+        loaded = set()
+        for _ in range(runs):
+            seconds, heavy = run_case(code, package)
+            timings.append(seconds)
+            loaded.update(heavy)
+        results[name] = {
+            "min_ms": round(min(timings) * 1000, 1),
+            "median_ms": round(statistics.median(timings) * 1000, 1),
+            "forbidden_imports": sorted(loaded & set(forbidden)),
+            "loaded": sorted(loaded),
+        }
+    baseline = results["python"]
+    for result in results.values():
+        result["overhead_ms"] = round(result["min_ms"] - baseline["min_ms"], 1)
+        result["forbidden_imports"] = sorted(set(result["forbidden_imports"]) - set(baseline["loaded"]))
+    for result in results.values():
+        del result["loaded"]
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup-time benchmark for uspkg and its CLI.")
+    parser.add_argument("--runs", type=int, default=10, help="Runs per case; the fastest is compared to the budget")
+    parser.add_argument("--max-ms", type=float, default=None, help="Fail if a case adds more than this to interpreter startup")
+    parser.add_argument("--output", "-o", help="Write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="uspkg-startup-") as work_dir:
+        results = run_suite(args.runs, make_package(work_dir))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    failures = []
+    for name, result in results.items():
+        if result["forbidden_imports"]:
+            failures.append(f"{name} imports {', '.join(result['forbidden_imports'])}")
+        if args.max_ms is not None and name != "python" and result["overhead_ms"] > args.max_ms:
+            failures.append(f"{name} adds {result['overhead_ms']} ms (budget {args.max_ms} ms)")
+    for failure in failures:
+        print(f"REGRESSION {failure}", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+if __name__ == "__main__":
+    main()
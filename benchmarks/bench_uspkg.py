@@ -0,0 +1,206 @@
+"""
+Benchmarks for creating, verifying, extracting and reading .uspkg files.
+
+Run the suite and save the results:
+
+    python benchmarks/bench_uspkg.py run --sizes 1M,64M,1G --output results.json
+
+Compare against a saved baseline (exits with status 1 on regressions):
+
+    python benchmarks/bench_uspkg.py compare baseline.json results.json
+
+Every operation runs in a fresh interpreter so that its wall time and peak RSS
+are measured in isolation. Everything runs offline; synthetic trees come from
+`generate.py`.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), "src")
+sys.path.insert(0, BENCHMARKS_DIR)
+if os.path.isdir(SRC_DIR):
+    sys.path.insert(0, SRC_DIR)
+
+from generate import generate_tree, parse_size
+
+OPERATIONS = ("create", "verify", "extract", "read_metadata")
+DEFAULT_SIZES = "1M,16M,256M"
+DEFAULT_THRESHOLD = 0.10
+
+def run_operation(operation, tree_dir, package, work_dir):
+    """Run one operation in this process. Used by the `measure` command."""
+    import uspkg
+
+    if operation == "create":
+        image_path = os.path.join(work_dir, "cover.png")
+        if not os.path.exists(image_path):
+            from PIL import Image
+            Image.new("RGB", (640, 480), (40, 90, 160)).save(image_path)
+        uspkg.create_encrypted_uspkg_with_uid(tree_dir, package, "Benchmark", "Synthetic package", image_path, "Fan Game", "main.exe")
+    elif operation == "verify":
+        if not uspkg.verify_uspkg_file(package):
+            raise RuntimeError("Verification failed.")
+    elif operation == "extract":
+        output_dir = os.path.join(work_dir, "extracted")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        # extract_encrypted_uspkg_with_uid only prints errors; a broken extract must fail the run, not time as a fast one.
+        from uspkg.uspkg import _extract
+        _extract(package, output_dir)
+        shutil.rmtree(output_dir, ignore_errors=True)
+    elif operation == "read_metadata":
+        uspkg.read_uspkg_metadata(package)
+    else:
+        raise ValueError(f"Unknown operation: {operation}")
+
+def measure(operation, tree_dir, package, work_dir):
+    """Run an operation in a child interpreter and return its wall time and peak RSS."""
+    command = [sys.executable, os.path.abspath(__file__), "measure", operation, tree_dir, package, work_dir]
+    completed = subprocess.run(command, check=True, stdout=subprocess.PIPE, universal_newlines=True)
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def tree_size(path):
+    return sum(os.path.getsize(os.path.join(root, file)) for root, _, files in os.walk(path) for file in files)
+
+def run_suite(sizes, operations, repeat=1, work_dir=None, seed=0):
+    results = []
+    keep_work_dir = work_dir is not None
+    work_dir = work_dir or tempfile.mkdtemp(prefix="uspkg-bench-")
+    try:
+        for size_text in sizes:
+            size = parse_size(size_text)
+            tree_dir = os.path.join(work_dir, f"tree-{size_text}-{seed}")
+            if not os.path.isdir(tree_dir):
+                generate_tree(tree_dir, size, seed)
+            input_bytes = tree_size(tree_dir)
+            package = os.path.join(work_dir, f"package-{size_text}.uspkg")
+
+            ordered = [op for op in OPERATIONS if op in operations]
+            if "create" not in ordered and not os.path.exists(package):
+                measure("create", tree_dir, package, work_dir)
+            for operation in ordered:
+                runs = [measure(operation, tree_dir, package, work_dir) for _ in range(repeat)]
+                seconds = min(run["seconds"] for run in runs)
+                peak_rss = max(run["peak_rss_kb"] for run in runs)
+                result = {
+                    "operation": operation,
+                    "size": size_text,
+                    "bytes": input_bytes,
+                    "package_bytes": os.path.getsize(package),
+                    "seconds": round(seconds, 4),
+                    "mb_per_second": round(input_bytes / (1024 * 1024) / seconds, 2) if seconds else None,
+                    "peak_rss_mb": round(peak_rss / 1024, 1),
+                }
+                results.append(result)
+                print(json.dumps(result), file=sys.stderr, flush=True)
+    finally:
+        if not keep_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare two result files.
+
+    Returns a list of regressions: operations whose throughput dropped, or
+    whose peak RSS grew, by more than `threshold`.
+    """
+    baseline_results = {(r["operation"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        key = (result["operation"], result["size"])
+        before = baseline_results.get(key)
+        if before is None:
+            continue
+        if before["mb_per_second"] and result["mb_per_second"] is not None:
+            change = result["mb_per_second"] / before["mb_per_second"] - 1
+            if change < -threshold:
+                regressions.append((key, "throughput", before["mb_per_second"], result["mb_per_second"], change))
+        if before["peak_rss_mb"]:
+            change = result["peak_rss_mb"] / before["peak_rss_mb"] - 1
+            if change > threshold:
+                regressions.append((key, "peak_rss_mb", before["peak_rss_mb"], result["peak_rss_mb"], change))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the uspkg library.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated tree sizes (default: {DEFAULT_SIZES})")
+    run_parser.add_argument("--operations", default=",".join(OPERATIONS), help="Comma-separated operations to measure")
+    run_parser.add_argument("--repeat", type=int, default=1, help="Runs per operation; the fastest is kept")
+    run_parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic trees")
+    run_parser.add_argument("--work-dir", help="Directory for trees and packages, kept between runs (default: a temporary directory)")
+    run_parser.add_argument("--output", "-o", help="Write the results as JSON to this file")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare results against a baseline")
+    compare_parser.add_argument("baseline", help="Baseline results JSON")
+    compare_parser.add_argument("current", help="Current results JSON")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="Relative change flagged as a regression (default: 0.10)")
+
+    measure_parser = subparsers.add_parser("measure", help=argparse.SUPPRESS)
+    measure_parser.add_argument("operation", choices=OPERATIONS)
+    measure_parser.add_argument("tree_dir")
+    measure_parser.add_argument("package")
+    measure_parser.add_argument("work_dir")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        operations = [op.strip() for op in args.operations.split(",")]
+        unknown = set(operations) - set(OPERATIONS)
+        if unknown:
+            parser.error(f"Unknown operations: {', '.join(sorted(unknown))}")
+        report = run_suite([s.strip() for s in args.sizes.split(",")], operations, args.repeat, args.work_dir, args.seed)
+        output = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w") as f:
+                f.write(output + "\n")
+        else:
+            print(output)
+    elif args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        regressions = compare(baseline, current, args.threshold)
+        for (operation, size), metric, before, after, change in regressions:
+            print(f"REGRESSION {operation} {size} {metric}: {before} -> {after} ({change:+.1%})")
+        if not regressions:
+            print("No regressions.")
+        sys.exit(1 if regressions else 0)
+    elif args.command == "measure":
+        import resource
+
+        start = time.perf_counter()
+        # Keep the operation's own prints off stdout, which carries the result.
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        try:
+            run_operation(args.operation, args.tree_dir, args.package, args.work_dir)
+        finally:
+            sys.stdout = stdout
+        seconds = time.perf_counter() - start
+        peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            peak_rss_kb //= 1024
+        print(json.dumps({"seconds": seconds, "peak_rss_kb": peak_rss_kb}))
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
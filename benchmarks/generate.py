@@ -0,0 +1,97 @@
+"""
+Deterministic synthetic package trees for the benchmarks.
+
+A tree of a given total size is split between many small files, a few huge
+files and medium files in between, and every file is either compressible
+(text-like) or incompressible (random-like). The same size and seed always
+produce byte-identical trees, so results are comparable across machines and
+runs.
+"""
+import hashlib
+import os
+import random
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+BLOCK_SIZE = 1024 * 1024
+
+# Share of the total size taken by each kind of file, and the size range of those files.
+LAYOUT = (
+    ("small", 0.3, 1024, 16 * 1024),
+    ("medium", 0.3, 64 * 1024, 1024 * 1024),
+    ("huge", 0.4, None, None),
+)
+HUGE_FILES = 2
+
+WORDS = (
+    b"lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    b"incididunt ut labore et dolore magna aliqua sprite tile palette level script "
+).split()
+
+def parse_size(text):
+    """Parse sizes such as "512K", "64M" or "2G" into bytes."""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper()
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def plan_tree(total_size, seed=0):
+    """Return a list of (relpath, size, compressible) describing the tree."""
+    rng = random.Random(seed)
+    files = []
+    for kind, share, min_size, max_size in LAYOUT:
+        budget = int(total_size * share)
+        if kind == "huge":
+            count = HUGE_FILES
+            sizes = [budget // count] * count
+            sizes[-1] += budget - sum(sizes)
+        else:
+            sizes = []
+            while budget > 0:
+                size = min(rng.randint(min_size, max_size), budget)
+                sizes.append(size)
+                budget -= size
+        for index, size in enumerate(sizes):
+            folder = f"{kind}/{index // 256:03d}"
+            files.append((f"{folder}/{kind}_{index:05d}.bin", size, rng.random() < 0.5))
+    return files
+
+def generate_tree(path, total_size, seed=0):
+    """Write the tree for `total_size` and `seed` under `path`. Returns the number of files."""
+    plan = plan_tree(total_size, seed)
+    text_block = _text_block(seed)
+    for index, (relpath, size, compressible) in enumerate(plan):
+        file_path = os.path.join(path, relpath)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, "wb") as f:
+            if compressible:
+                _write_text(f, size, text_block, index)
+            else:
+                _write_random(f, size, seed, index)
+    return len(plan)
+
+def _text_block(seed):
+    rng = random.Random(seed)
+    block = bytearray()
+    while len(block) < BLOCK_SIZE:
+        block += rng.choice(WORDS) + (b"\n" if rng.random() < 0.1 else b" ")
+    return bytes(block[:BLOCK_SIZE])
+
+def _write_text(f, size, text_block, index):
+    # Rotate the block per file so files are not identical to each other.
+    offset = (index * 7919) % len(text_block)
+    rotated = text_block[offset:] + text_block[:offset]
+    while size > 0:
+        chunk = rotated[:size]
+        f.write(chunk)
+        size -= len(chunk)
+
+def _write_random(f, size, seed, index):
+    # AES-CTR keystream: deterministic, incompressible and fast to produce.
+    key = hashlib.sha256(f"{seed}:{index}".encode()).digest()
+    encryptor = Cipher(algorithms.AES(key), modes.CTR(b"\0" * 16)).encryptor()
+    zeros = bytes(BLOCK_SIZE)
+    while size > 0:
+        length = min(size, BLOCK_SIZE)
+        f.write(encryptor.update(zeros[:length]))
+        size -= length
@@ -1,6 +1,42 @@
-from .uspkg import (
-    create_encrypted_uspkg_with_uid,
-    verify_uspkg_file,
-    extract_encrypted_uspkg_with_uid,
-    read_uspkg_metadata
-)
+# Names are loaded from their submodules on first access, so that `import uspkg`
+# stays cheap and tools that only read metadata never import cryptography,
+# zipfile or Pillow.
+_EXPORTS = {
+    "create_encrypted_uspkg_with_uid": ".uspkg",
+    "create_delta_uspkg": ".uspkg",
+    "apply_delta": ".uspkg",
+    "verify_uspkg_file": ".uspkg",
+    "verify_directory": ".uspkg",
+    "extract_encrypted_uspkg_with_uid": ".uspkg",
+    "install_uspkg": ".uspkg",
+    "install_uspkg_from_url": ".uspkg",
+    "update_uspkg_metadata": ".uspkg",
+    "read_uspkg_metadata": ".metadata",
+    "extract_member": ".uspkg",
+    "extract_matching": ".uspkg",
+    "verify_packages": ".uspkg",
+    "VERIFY_LEVELS": "._utils",
+    "UspkgFile": ".metadata",
+    "read_uspkg_trailer": ".metadata",
+    "get_image_data": ".metadata",
+    "get_format_version": ".metadata",
+    "Catalog": ".catalog",
+    "Store": ".store",
+    "Instrumentation": ".instrumentation",
+    "StageCollector": ".instrumentation",
+    "StageEvent": ".instrumentation",
+}
+
+__all__ = list(_EXPORTS)
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_EXPORTS))
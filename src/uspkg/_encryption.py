@@ -1,9 +1,18 @@
+import io
 import secrets
+from collections import deque
+from cryptography.exceptions import InvalidTag
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 from cryptography.hazmat.backends import default_backend
 import hashlib
+from ._utils import DEFAULT_CHUNK_SIZE
+from .instrumentation import NULL_INSTRUMENTATION
 
 AES_BLOCK_SIZE = 16
+GCM_TAG_SIZE = 16
+GCM_NONCE_PREFIX_SIZE = 8
+DEFAULT_SEGMENT_SIZE = 1024 * 1024
 
 def _generate_key_from_uid(uid: str):
     return hashlib.sha256(uid.encode()).digest()
@@ -18,3 +27,381 @@ def _decrypt_data(key, iv, encrypted_data):
     cipher = Cipher(algorithms.AES(key), modes.CFB(iv), backend=default_backend())
     decryptor = cipher.decryptor()
     return decryptor.update(encrypted_data) + decryptor.finalize()
+
+class _EncryptingWriter:
+    """
+    Write-only file object that encrypts everything written to it with AES-CFB
+    and forwards the ciphertext to `fileobj`.
+
+    Data is buffered up to `chunk_size` bytes, so memory use stays bounded no
+    matter how much is written. SHA-256 digests of both the plaintext and the
+    ciphertext are kept up to date as data flows through. The object is not
+    seekable, which makes `zipfile.ZipFile` write members with data descriptors
+    instead of seeking back to patch local headers.
+    """
+
+    def __init__(self, fileobj, key, chunk_size=DEFAULT_CHUNK_SIZE, instrumentation=None):
+        self.iv = secrets.token_bytes(AES_BLOCK_SIZE)
+        self.plain_hash = hashlib.sha256()
+        self.encrypted_hash = hashlib.sha256()
+        self._fileobj = fileobj
+        self._chunk_size = chunk_size
+        self._encryptor = Cipher(algorithms.AES(key), modes.CFB(self.iv), backend=default_backend()).encryptor()
+        self._buffer = bytearray()
+        self._position = 0
+        self._instrumentation = instrumentation or NULL_INSTRUMENTATION
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= self._chunk_size:
+            self._flush_buffer()
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        self._flush_buffer()
+        self._fileobj.flush()
+
+    def close(self):
+        """Flush pending data and finalize the cipher. The underlying file is left open."""
+        if self._encryptor is None:
+            return
+        self._flush_buffer()
+        self._write_encrypted(self._encryptor.finalize())
+        self._encryptor = None
+
+    def _flush_buffer(self):
+        if not self._buffer:
+            return
+        length = len(self._buffer)
+        with self._instrumentation.stage("hash", length):
+            self.plain_hash.update(self._buffer)
+        with self._instrumentation.stage("encrypt", length):
+            encrypted_data = self._encryptor.update(self._buffer)
+        self._write_encrypted(encrypted_data)
+        self._buffer.clear()
+
+    def _write_encrypted(self, encrypted_data):
+        if encrypted_data:
+            with self._instrumentation.stage("hash", len(encrypted_data)):
+                self.encrypted_hash.update(encrypted_data)
+            with self._instrumentation.stage("write", len(encrypted_data)):
+                self._fileobj.write(encrypted_data)
+
+class _DecryptingReader(io.RawIOBase):
+    """
+    Seekable, read-only view of an AES-CFB payload stored in `fileobj`.
+
+    The payload occupies `size` bytes starting at `offset`. In CFB mode each
+    block only depends on the previous ciphertext block, so after a seek the
+    decryptor is restarted from the nearest block boundary using that block as
+    the IV; only the bytes that are actually read get decrypted.
+    """
+
+    def __init__(self, fileobj, key, iv, size, offset=0, instrumentation=None):
+        self._fileobj = fileobj
+        self._key = key
+        self._iv = iv
+        self._size = size
+        self._offset = offset
+        self._position = 0
+        self._decryptor = None
+        self._instrumentation = instrumentation or NULL_INSTRUMENTATION
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            # OSError, like a real file, which is what zipfile expects when probing for ZIP64 records
+            raise OSError(f"Negative seek position: {position}")
+        if position != self._position:
+            self._decryptor = None
+            self._position = position
+        return position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self._size - self._position)
+        if length <= 0:
+            return 0
+        if self._decryptor is None:
+            self._start_decryptor()
+        with self._instrumentation.stage("read", length):
+            self._fileobj.seek(self._offset + self._position)
+            encrypted_data = self._fileobj.read(length)
+        with self._instrumentation.stage("decrypt", len(encrypted_data)):
+            data = self._decryptor.update(encrypted_data)
+        self._on_read(self._position, encrypted_data, data)
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def _on_read(self, position, encrypted_data, data):
+        """Hook called with every block of ciphertext read and its decrypted plaintext."""
+
+    def _start_decryptor(self):
+        block_start = self._position - self._position % AES_BLOCK_SIZE
+        if block_start == 0:
+            iv = self._iv
+        else:
+            self._fileobj.seek(self._offset + block_start - AES_BLOCK_SIZE)
+            iv = self._fileobj.read(AES_BLOCK_SIZE)
+        decryptor = Cipher(algorithms.AES(self._key), modes.CFB(iv), backend=default_backend()).decryptor()
+        skip = self._position - block_start
+        if skip:
+            self._fileobj.seek(self._offset + block_start)
+            decryptor.update(self._fileobj.read(skip))
+        self._decryptor = decryptor
+
+class _HashingDecryptingReader(_DecryptingReader):
+    """
+    `_DecryptingReader` that also computes SHA-256 digests of the ciphertext and
+    of the plaintext while the payload is being read.
+
+    Only reads that continue from the end of the hashed prefix extend the
+    digests, so a consumer that mostly reads front to back (such as walking ZIP
+    members in archive order) gets both digests without a second pass.
+    `finish` reads and hashes whatever part of the payload was skipped.
+    `progress_callback` is called with the percentage of the payload hashed so far.
+    """
+
+    def __init__(self, fileobj, key, iv, size, offset=0, progress_callback=None, instrumentation=None):
+        super().__init__(fileobj, key, iv, size, offset, instrumentation)
+        self.plain_hash = hashlib.sha256()
+        self.encrypted_hash = hashlib.sha256()
+        self._hashed_size = 0
+        self._progress_callback = progress_callback
+
+    def _on_read(self, position, encrypted_data, data):
+        end = position + len(encrypted_data)
+        if position <= self._hashed_size < end:
+            skip = self._hashed_size - position
+            with self._instrumentation.stage("hash", 2 * (end - self._hashed_size)):
+                self.encrypted_hash.update(memoryview(encrypted_data)[skip:])
+                self.plain_hash.update(memoryview(data)[skip:])
+            self._hashed_size = end
+            if self._progress_callback:
+                self._progress_callback(self._hashed_size / self._size * 100)
+
+    def finish(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Hash the rest of the payload. Returns the ciphertext and plaintext hex digests."""
+        self.seek(self._hashed_size)
+        while self.read(chunk_size):
+            pass
+        return self.encrypted_hash.hexdigest(), self.plain_hash.hexdigest()
+
+def _segment_count(size, segment_size):
+    """Number of segments holding `size` bytes. An empty payload still has one (empty) segment."""
+    return max(1, -(-size // segment_size))
+
+def _segment_nonce(iv, index):
+    return iv[:GCM_NONCE_PREFIX_SIZE] + index.to_bytes(4, 'big')
+
+def _segment_aad(is_last):
+    # Binding the last segment's position in its tag makes truncation at a segment boundary detectable.
+    return b"\x01" if is_last else b"\x00"
+
+def _seal_segment(aesgcm, iv, index, data, is_last):
+    return aesgcm.encrypt(_segment_nonce(iv, index), data, _segment_aad(is_last))
+
+def _open_segment(aesgcm, iv, index, data, is_last):
+    try:
+        return aesgcm.decrypt(_segment_nonce(iv, index), data, _segment_aad(is_last))
+    except InvalidTag:
+        raise ValueError(f"Segment {index} failed authentication.") from None
+
+class _SegmentEncryptingWriter:
+    """
+    Write-only file object for the v2 format: everything written to it is cut
+    into `segment_size` segments, each sealed with AES-GCM under a nonce made
+    of a random prefix and the segment index, and written to `fileobj` as the
+    ciphertext followed by its 16-byte tag.
+
+    Segments are sealed on `executor` while the next ones are being produced;
+    at most `2 * window` segments are in flight. Like `_EncryptingWriter`, the
+    object is not seekable.
+    """
+
+    def __init__(self, fileobj, key, executor, window=1, segment_size=DEFAULT_SEGMENT_SIZE, instrumentation=None):
+        # The nonce prefix is stored in the 16-byte IV slot of the trailer.
+        self.iv = secrets.token_bytes(AES_BLOCK_SIZE)
+        self.segment_size = segment_size
+        self.segment_count = 0
+        self._fileobj = fileobj
+        self._aesgcm = AESGCM(key)
+        self._executor = executor
+        self._window = max(window, 1)
+        self._pending = deque()
+        self._buffer = bytearray()
+        self._position = 0
+        self._closed = False
+        self._instrumentation = instrumentation or NULL_INSTRUMENTATION
+
+    def write(self, data):
+        self._buffer += data
+        self._position += len(data)
+        # Keep at least one byte buffered: a segment can only be sealed once it is known whether it is the last one.
+        while len(self._buffer) > self.segment_size:
+            segment = bytes(self._buffer[:self.segment_size])
+            del self._buffer[:self.segment_size]
+            self._submit(segment, False)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        while self._pending and self._pending[0].done():
+            self._write_next()
+        self._fileobj.flush()
+
+    def close(self):
+        """Seal the last segment and write out every pending one. The underlying file is left open."""
+        if self._closed:
+            return
+        self._submit(bytes(self._buffer), True)
+        self._buffer.clear()
+        while self._pending:
+            self._write_next()
+        self._closed = True
+
+    def _submit(self, segment, is_last):
+        index = self.segment_count
+        self.segment_count += 1
+        self._pending.append(self._executor.submit(self._seal, index, segment, is_last))
+        if len(self._pending) >= 2 * self._window:
+            self._write_next()
+
+    def _seal(self, index, segment, is_last):
+        with self._instrumentation.stage("encrypt", len(segment)):
+            return _seal_segment(self._aesgcm, self.iv, index, segment, is_last)
+
+    def _write_next(self):
+        sealed = self._pending.popleft().result()
+        with self._instrumentation.stage("write", len(sealed)):
+            self._fileobj.write(sealed)
+
+class _SegmentDecryptingReader(io.RawIOBase):
+    """
+    Seekable, read-only view of a v2 payload of `size` plaintext bytes stored
+    in `fileobj` at `offset`.
+
+    Any byte range is served by decrypting and authenticating only the
+    segments it overlaps; the last segment decrypted is kept for the next
+    read. A segment that fails authentication raises ValueError.
+    `finish` authenticates the segments that were never read, and
+    `progress_callback` is called with the percentage of segments
+    authenticated so far.
+    """
+
+    def __init__(self, fileobj, key, iv, segment_size, size, offset=0, progress_callback=None, instrumentation=None):
+        self._fileobj = fileobj
+        self._aesgcm = AESGCM(key)
+        self._iv = iv
+        self._segment_size = segment_size
+        self._size = size
+        self._offset = offset
+        self._position = 0
+        self._segment_count = _segment_count(size, segment_size)
+        self._segment_index = None
+        self._segment_data = b""
+        self._authenticated = set()
+        self._progress_callback = progress_callback
+        self._instrumentation = instrumentation or NULL_INSTRUMENTATION
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._position + offset
+        elif whence == io.SEEK_END:
+            position = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise OSError(f"Negative seek position: {position}")
+        self._position = position
+        return position
+
+    def readinto(self, buffer):
+        if self._position >= self._size:
+            return 0
+        index, start = divmod(self._position, self._segment_size)
+        if index != self._segment_index:
+            self._segment_data = self._open(index, self._read_sealed(index))
+            self._segment_index = index
+        data = memoryview(self._segment_data)[start:start + len(buffer)]
+        buffer[:len(data)] = data
+        self._position += len(data)
+        return len(data)
+
+    def finish(self, executor=None, window=1):
+        """Authenticate every segment not read so far, opening them on `executor` if given."""
+        missing = [index for index in range(self._segment_count) if index not in self._authenticated]
+        if executor is None:
+            for index in missing:
+                self._open(index, self._read_sealed(index))
+            return
+        pending = deque()
+        for index in missing:
+            pending.append((index, executor.submit(self._decrypt, index, self._read_sealed(index))))
+            if len(pending) >= 2 * max(window, 1):
+                self._finish_next(pending)
+        while pending:
+            self._finish_next(pending)
+
+    def _finish_next(self, pending):
+        index, future = pending.popleft()
+        future.result()
+        self._mark_authenticated(index)
+
+    def _read_sealed(self, index):
+        start = index * self._segment_size
+        length = min(self._segment_size, self._size - start) + GCM_TAG_SIZE
+        with self._instrumentation.stage("read", length):
+            self._fileobj.seek(self._offset + start + index * GCM_TAG_SIZE)
+            sealed = self._fileobj.read(length)
+        if len(sealed) != length:
+            raise ValueError(f"Segment {index} is truncated.")
+        return sealed
+
+    def _open(self, index, sealed):
+        data = self._decrypt(index, sealed)
+        self._mark_authenticated(index)
+        return data
+
+    def _decrypt(self, index, sealed):
+        with self._instrumentation.stage("decrypt", len(sealed)):
+            return _open_segment(self._aesgcm, self._iv, index, sealed, index == self._segment_count - 1)
+
+    def _mark_authenticated(self, index):
+        if index not in self._authenticated:
+            self._authenticated.add(index)
+            if self._progress_callback:
+                self._progress_callback(len(self._authenticated) / self._segment_count * 100)
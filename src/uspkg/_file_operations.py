@@ -1,31 +1,327 @@
 import os
 import zipfile
 import io
-from ._utils import _calculate_sha256
-
-def _zip_folder(folder_path, update_progress_callback=None):
-    metadata = {"files": {}, "zipHash": ""}
-    zip_file_path = 'temp_folder.zip'
-
-    # Calculate total number of files
-    total_files = sum([len(files) for _, _, files in os.walk(folder_path)])
-    
-    file_count = 0
-    with zipfile.ZipFile(zip_file_path, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, folder_path)
-                zip_file.write(file_path, arcname)
-                metadata["files"][arcname] = _calculate_sha256(file_path)
-                
-                file_count += 1
-                progress_percent = (file_count / total_files) * 100
-                if update_progress_callback:
-                    update_progress_callback(progress_percent)
-                
-    metadata["zipHash"] = _calculate_sha256(zip_file_path)
-    return zip_file_path, metadata
+import zlib
+import shutil
+import hashlib
+import tempfile
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from ._utils import DEFAULT_CHUNK_SIZE
+from ._hashing import read_blocks, sha256_files
+from .instrumentation import NULL_INSTRUMENTATION, _ByteProgress
+
+def _zip_folder(folder_path, fileobj, update_progress_callback=None, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, entries=None, hash_cache=None, policy=None, instrumentation=None):
+    """
+    Write the contents of `folder_path` as a ZIP archive into `fileobj`.
+
+    `fileobj` only needs `write`, `tell` and `flush`. With one worker, members
+    are streamed into it one chunk at a time, so nothing is staged on disk or
+    held in memory.
+
+    Every file is read once, feeding both its SHA-256 hash and the compressor.
+    With `workers` > 1, files are hashed and compressed concurrently by a
+    thread pool (hashlib and the compressors release the GIL) and the compressed members
+    are written into the archive in the same fixed order as the sequential path.
+    Each compressed member is spooled in memory up to `chunk_size` bytes and
+    then in a temporary file until its turn to be written comes.
+
+    `entries` restricts the archive to a subset of `_scan_folder(folder_path)`.
+    With a `hash_cache`, files whose size and mtime match it are not hashed
+    again (their cached hash is used, so a delta build does not hash the
+    changed files a second time), and the hashes computed along the way are
+    recorded in it for later builds.
+    `policy` is a `_CompressionPolicy` choosing how each file is compressed.
+    Progress is reported as the percentage of bytes read, so large files do
+    not stall it.
+    """
+    metadata = {"files": {}}
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+
+    with instrumentation.stage("scan") as span:
+        if entries is None:
+            entries = _scan_folder(folder_path)
+        stats = {arcname: os.stat(file_path) for file_path, arcname in entries}
+        total_bytes = sum(stat.st_size for stat in stats.values())
+        known_hashes = {}
+        if hash_cache is not None:
+            known_hashes = {arcname: hash_cache.get(arcname, stat) for arcname, stat in stats.items()}
+        span.files = len(entries)
+    progress = _ByteProgress(total_bytes, update_progress_callback)
+
+    with zipfile.ZipFile(fileobj, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        if workers > 1:
+            members = _write_members_parallel(zip_file, entries, workers, chunk_size, policy, instrumentation, progress, known_hashes)
+        else:
+            members = (
+                (arcname, _write_file_member(zip_file, file_path, arcname, chunk_size, policy, instrumentation, progress, known_hashes.get(arcname)))
+                for file_path, arcname in entries
+            )
+
+        for arcname, file_hash in members:
+            metadata["files"][arcname] = file_hash
+            if hash_cache is not None and known_hashes[arcname] is None:
+                hash_cache.put(arcname, os.stat(os.path.join(folder_path, arcname)), file_hash)
+
+    if not entries:
+        progress.advance(0)
+    return metadata
+
+def _scan_folder(folder_path):
+    """List (file_path, arcname) pairs for every file under `folder_path`, in a stable order."""
+    entries = []
+    for root, dirs, files in os.walk(folder_path):
+        dirs.sort()
+        for file in sorted(files):
+            file_path = os.path.join(root, file)
+            entries.append((file_path, os.path.relpath(file_path, folder_path)))
+    return entries
+
+class _HashCache:
+    """
+    Persistent map of file hashes keyed by (relpath, size, mtime_ns), stored as JSON.
+
+    A hit means the file has not changed since it was last hashed, so its
+    hash can be reused without reading it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+
+    def get(self, arcname, stat):
+        entry = self._entries.get(arcname)
+        if entry and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+            return entry[2]
+        return None
+
+    def put(self, arcname, stat, file_hash):
+        self._entries[arcname] = [stat.st_size, stat.st_mtime_ns, file_hash]
+
+    def save(self):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f)
+        os.replace(temp_path, self.path)
+
+def _hash_entries(entries, hash_cache=None, workers=1, instrumentation=None):
+    """Return {arcname: sha256} for `entries`, only reading files that miss `hash_cache`."""
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    hashes = {}
+    misses = []
+    for file_path, arcname in entries:
+        stat = os.stat(file_path)
+        file_hash = hash_cache.get(arcname, stat) if hash_cache is not None else None
+        if file_hash is None:
+            misses.append((file_path, arcname, stat))
+        else:
+            hashes[arcname] = file_hash
+
+    with instrumentation.stage("hash", sum(stat.st_size for _, _, stat in misses), files=len(misses)):
+        file_hashes = sha256_files([file_path for file_path, _, _ in misses], max(workers, 1))
+    for (_, arcname, stat), file_hash in zip(misses, file_hashes):
+        hashes[arcname] = file_hash
+        if hash_cache is not None:
+            hash_cache.put(arcname, stat, file_hash)
+    return hashes
+
+COMPRESSION_METHODS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflate": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
+# Formats that are already compressed; deflating them costs CPU for no gain.
+INCOMPRESSIBLE_EXTENSIONS = frozenset({
+    ".zip", ".7z", ".rar", ".gz", ".tgz", ".bz2", ".xz", ".lz4", ".zst", ".cab", ".uspkg",
+    ".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif",
+    ".ogg", ".oga", ".opus", ".mp3", ".m4a", ".aac", ".flac", ".wma",
+    ".mp4", ".m4v", ".mkv", ".webm", ".avi", ".mov", ".wmv", ".bik", ".usm",
+    ".chd", ".cso", ".rvz", ".wbfs", ".nsp", ".xci", ".cia",
+})
+AUTO_SAMPLE_SIZE = 64 * 1024
+AUTO_MAX_RATIO = 0.9
+
+class _CompressionPolicy:
+    """
+    Chooses the compression method of each member.
+
+    `compression` is one of the keys of `COMPRESSION_METHODS`, or "auto". In
+    auto mode a file is stored if its extension is in
+    `INCOMPRESSIBLE_EXTENSIONS` or if a fast deflate of its first
+    `AUTO_SAMPLE_SIZE` bytes saves less than 10%; otherwise it is deflated.
+    `compresslevel` is passed to the compressor (ignored for stored and lzma).
+    """
+
+    def __init__(self, compression="deflate", compresslevel=None):
+        if compression != "auto" and compression not in COMPRESSION_METHODS:
+            raise ValueError(f"Unknown compression: {compression}")
+        self.compression = compression
+        self.compresslevel = compresslevel
+
+    def choose(self, arcname, sample):
+        """Return the zipfile compression constant for a file, given its first bytes."""
+        if self.compression != "auto":
+            return COMPRESSION_METHODS[self.compression]
+        if os.path.splitext(arcname)[1].lower() in INCOMPRESSIBLE_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        sample = sample[:AUTO_SAMPLE_SIZE]
+        if not sample or len(zlib.compress(sample, 1)) >= len(sample) * AUTO_MAX_RATIO:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+def _get_compressor(compress_type, compresslevel=None):
+    """Return a compressor with `compress`/`flush` for raw ZIP member data, or None for stored members."""
+    if compress_type == zipfile.ZIP_DEFLATED:
+        return zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if compresslevel is None else compresslevel, zlib.DEFLATED, -15)
+    if compress_type == zipfile.ZIP_BZIP2:
+        import bz2
+        return bz2.BZ2Compressor(9 if compresslevel is None else compresslevel)
+    if compress_type == zipfile.ZIP_LZMA:
+        # zipfile's LZMACompressor writes the property header ZIP readers expect.
+        return zipfile.LZMACompressor()
+    return None
+
+def _read_blocks(src, chunk_size, instrumentation):
+    """
+    Yield the blocks of `src`, timing each read in the "read" stage.
+
+    Blocks are views over a reused buffer (see `_hashing.read_blocks`); zipfile,
+    the compressors and the encrypting writers all copy what they keep.
+    """
+    blocks = read_blocks(src, chunk_size)
+    while True:
+        with instrumentation.stage("read") as span:
+            block = next(blocks, None)
+            span.bytes = len(block) if block is not None else 0
+        if block is None:
+            return
+        yield block
+
+def _write_file_member(zip_file, file_path, arcname, chunk_size=DEFAULT_CHUNK_SIZE, policy=None, instrumentation=None, progress=None, known_hash=None):
+    """
+    Stream a file into `zip_file` and return its SHA-256 hash, reading it only once.
+
+    If `known_hash` is given, the file is not hashed and `known_hash` is returned.
+    """
+    policy = policy or _CompressionPolicy()
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    sha256_hash = hashlib.sha256()
+    with open(file_path, 'rb') as src:
+        blocks = _read_blocks(src, chunk_size, instrumentation)
+        first_block = next(blocks, b"")
+        zinfo.compress_type = policy.choose(arcname, first_block)
+        zinfo._compresslevel = policy.compresslevel
+        with zip_file.open(zinfo, 'w') as dest:
+            for block in _chain_first(first_block, blocks):
+                if known_hash is None:
+                    with instrumentation.stage("hash", len(block)):
+                        sha256_hash.update(block)
+                # Encryption and writing happen inside dest.write and are timed as their own stages.
+                with instrumentation.stage("compress", len(block)):
+                    dest.write(block)
+                if progress:
+                    progress.advance(len(block))
+    instrumentation.add_files("compress")
+    return known_hash or sha256_hash.hexdigest()
+
+def _chain_first(first_block, blocks):
+    if first_block:
+        yield first_block
+        yield from blocks
+
+def _compress_file(file_path, arcname, chunk_size=DEFAULT_CHUNK_SIZE, policy=None, instrumentation=None, progress=None, known_hash=None):
+    """
+    Hash and compress a file in a single read.
+
+    Returns the `ZipInfo` for the member, its SHA-256 hash and a temporary file
+    holding the raw member data. The temporary file stays in memory up to
+    `chunk_size` bytes and spills to disk beyond that. If `known_hash` is
+    given, the file is not hashed and `known_hash` is returned as its hash.
+    """
+    policy = policy or _CompressionPolicy()
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    zinfo = zipfile.ZipInfo.from_file(file_path, arcname)
+    sha256_hash = hashlib.sha256()
+    crc = 0
+    file_size = 0
+    compressed_data = tempfile.SpooledTemporaryFile(max_size=chunk_size)
+    try:
+        with open(file_path, 'rb') as src:
+            blocks = _read_blocks(src, chunk_size, instrumentation)
+            first_block = next(blocks, b"")
+            zinfo.compress_type = policy.choose(arcname, first_block)
+            compressor = _get_compressor(zinfo.compress_type, policy.compresslevel)
+            for block in _chain_first(first_block, blocks):
+                if known_hash is None:
+                    with instrumentation.stage("hash", len(block)):
+                        sha256_hash.update(block)
+                with instrumentation.stage("compress", len(block)):
+                    crc = zlib.crc32(block, crc)
+                    compressed_data.write(compressor.compress(block) if compressor else block)
+                file_size += len(block)
+                if progress:
+                    progress.advance(len(block))
+        if compressor:
+            with instrumentation.stage("compress"):
+                compressed_data.write(compressor.flush())
+    except BaseException:
+        compressed_data.close()
+        raise
+    instrumentation.add_files("compress")
+    zinfo.file_size = file_size
+    zinfo.CRC = crc
+    zinfo.compress_size = compressed_data.tell()
+    compressed_data.seek(0)
+    return zinfo, known_hash or sha256_hash.hexdigest(), compressed_data
+
+def _write_members_parallel(zip_file, entries, workers, chunk_size=DEFAULT_CHUNK_SIZE, policy=None, instrumentation=None, progress=None, known_hashes=None):
+    """
+    Run `_compress_file` over `entries` on a thread pool and write the results
+    into `zip_file` in order, yielding (arcname, hash) as each member is written.
+
+    At most `2 * workers` files are in flight, which bounds the memory held by
+    compressed members waiting to be written. Files in `known_hashes`
+    ({arcname: hash}) are not hashed again.
+    """
+    known_hashes = known_hashes or {}
+    def write_next():
+        zinfo, file_hash, compressed_data = pending.popleft().result()
+        with compressed_data:
+            _write_compressed_member(zip_file, zinfo, compressed_data, chunk_size)
+        return zinfo.filename, file_hash
+
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for file_path, arcname in entries:
+            pending.append(executor.submit(_compress_file, file_path, arcname, chunk_size, policy, instrumentation, progress, known_hashes.get(arcname)))
+            if len(pending) >= 2 * workers:
+                yield write_next()
+        while pending:
+            yield write_next()
+
+def _write_compressed_member(zip_file, zinfo, compressed_data, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Append an already compressed member to `zip_file`.
+
+    zipfile has no public API for raw members, so this does what
+    `ZipFile.writestr` does internally: write the local header and the data,
+    then register the entry for the central directory.
+    """
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    zinfo.header_offset = zip_file.fp.tell()
+    zip_file.fp.write(zinfo.FileHeader(zip64))
+    shutil.copyfileobj(compressed_data, zip_file.fp, chunk_size)
+    zip_file.filelist.append(zinfo)
+    zip_file.NameToInfo[zinfo.filename] = zinfo
+    zip_file.start_dir = zip_file.fp.tell()
+    zip_file._didModify = True
 
 def _extract_zip(zip_data, output_dir):
     with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zip_ref:
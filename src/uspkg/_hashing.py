@@ -0,0 +1,101 @@
+"""
+SHA-256 of paths, file objects and in-memory buffers.
+
+Files are read with `readinto` into large buffers that are reused from one
+file to the next, and files past `MMAP_THRESHOLD` are mapped and hashed in a
+single call, so the time goes to hashlib (which releases the GIL on large
+updates) rather than to interpreter overhead.
+"""
+import hashlib
+import mmap
+import os
+import threading
+
+BUFFER_SIZE = 1024 * 1024
+MMAP_THRESHOLD = 64 * 1024 * 1024
+
+_local = threading.local()
+_FREE_BUFFERS_PER_THREAD = 4
+
+def sha256(source, buffer_size=BUFFER_SIZE):
+    """
+    Return the hex SHA-256 of `source`.
+
+    Args:
+    source: A path, a binary file object (read from its current position to
+        the end), or a bytes-like object such as bytes, bytearray, memoryview
+        or mmap.
+    """
+    hasher = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        _update_from_path(hasher, source, buffer_size)
+    elif isinstance(source, (bytes, bytearray, memoryview, mmap.mmap)):
+        hasher.update(source)
+    else:
+        update_from_file(hasher, source, buffer_size)
+    return hasher.hexdigest()
+
+def sha256_files(paths, workers=None):
+    """Hash a list of files on a pool of `workers` threads. Returns the hex digests in the order of `paths`."""
+    paths = list(paths)
+    if workers == 1 or len(paths) < 2:
+        return [sha256(path) for path in paths]
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(sha256, paths))
+
+def update_from_file(hasher, fileobj, buffer_size=BUFFER_SIZE):
+    """Feed the rest of `fileobj` to `hasher`."""
+    for block in read_blocks(fileobj, buffer_size):
+        hasher.update(block)
+
+def read_blocks(fileobj, buffer_size=BUFFER_SIZE):
+    """
+    Yield the rest of `fileobj` as memoryviews over a reused buffer.
+
+    Each view is only valid until the next one is requested; consumers that
+    keep data around must copy it.
+    """
+    if not hasattr(fileobj, "readinto"):
+        yield from iter(lambda: fileobj.read(buffer_size), b"")
+        return
+    buffer = _take_buffer(buffer_size)
+    view = memoryview(buffer)
+    try:
+        while True:
+            length = fileobj.readinto(buffer)
+            if not length:
+                return
+            yield view[:length]
+    finally:
+        _give_back_buffer(buffer)
+
+def _update_from_path(hasher, path, buffer_size):
+    with open(path, 'rb', buffering=0) as f:
+        if os.fstat(f.fileno()).st_size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                hasher.update(mapped)
+        else:
+            update_from_file(hasher, f, buffer_size)
+
+def _take_buffer(size):
+    # Each thread keeps the buffers it has used; nested readers get their own.
+    free = _free_buffers()
+    for i, buffer in enumerate(free):
+        if len(buffer) == size:
+            return free.pop(i)
+    return bytearray(size)
+
+def _give_back_buffer(buffer):
+    # An abandoned reader may be finalized on another thread than the one that
+    # took its buffer, which may never read again; keep only a few per thread.
+    free = _free_buffers()
+    if len(free) < _FREE_BUFFERS_PER_THREAD:
+        free.append(buffer)
+
+def _free_buffers():
+    free = getattr(_local, "free", None)
+    if free is None:
+        free = _local.free = []
+    return free
@@ -0,0 +1,260 @@
+"""
+Random access to a .uspkg file served over HTTP.
+
+`_HttpSource` reads a remote file with Range requests over a small pool of
+keep-alive connections. The end of the file (trailer, ZIP directory) is
+fetched with a single suffix range when the source is opened; the rest is
+read through a cache of fixed-size blocks. A single download frontier walks
+the file in order, keeping a bounded number of blocks downloaded ahead of the
+readers, so packages can be installed straight from the server with the
+download running ahead of decryption and extraction instead of before them,
+and each block is downloaded once however many threads read the package.
+"""
+import http.client
+import io
+import queue
+import re
+import threading
+import urllib.parse
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from ._utils import DEFAULT_CHUNK_SIZE
+
+HTTP_CONNECTIONS = 4
+HTTP_BLOCK_SIZE = 1024 * 1024
+HTTP_READ_AHEAD = 8
+HTTP_TAIL_SIZE = 64 * 1024
+HTTP_TIMEOUT = 30
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+def is_url(path):
+    """Return True if `path` is an http(s) URL rather than a local path."""
+    return isinstance(path, str) and path.lower().startswith(("http://", "https://"))
+
+class _HttpSource:
+    """
+    A remote file read with HTTP Range requests.
+
+    `open` returns an independent seekable reader; readers share the
+    connections and the block cache, so each install thread can have its own.
+    At most `connections` requests are in flight. The frontier keeps up to
+    `read_ahead` blocks downloaded (or downloading) that no reader has read
+    yet; it skips blocks that every reader has moved past, and blocks a reader
+    needs before the frontier gets there are fetched on demand. Blocks are
+    only evicted once they have been read and downloaded, and never while a
+    reader is positioned in them. The most recently
+    read ones are kept for readers that share a block: per open reader, as
+    many as its buffered reader reads ahead (`chunk_size`) plus two.
+    The server must answer range requests with 206 Partial Content.
+    """
+
+    def __init__(self, url, connections=HTTP_CONNECTIONS, block_size=HTTP_BLOCK_SIZE, read_ahead=HTTP_READ_AHEAD, timeout=HTTP_TIMEOUT, chunk_size=DEFAULT_CHUNK_SIZE):
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ("http", "https") or not parts.hostname:
+            raise ValueError(f"Unsupported URL: {url}")
+        self.url = url
+        self.block_size = block_size
+        self._connection_class = http.client.HTTPSConnection if parts.scheme == "https" else http.client.HTTPConnection
+        self._address = (parts.hostname, parts.port)
+        self._target = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        self._timeout = timeout
+        self._read_ahead = max(read_ahead, connections)
+        self._kept_per_reader = 2 + -(-chunk_size // block_size)
+        self._idle = queue.LifoQueue()
+        self._blocks = {}
+        self._unread = set()
+        self._recent = OrderedDict()
+        self._fetched = set()
+        self._first_unfetched = 0
+        self._positions = {}
+        self._readers = 0
+        self._lock = threading.Lock()
+        self._closed = False
+        self._executor = ThreadPoolExecutor(max_workers=connections)
+        try:
+            self._fetch_tail()
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def open(self):
+        """Return a new seekable binary reader over the remote file."""
+        with self._lock:
+            self._readers += 1
+        return _HttpReader(self)
+
+    def readinto_at(self, position, buffer, reader=None):
+        """Fill `buffer` from `position` on. Returns the number of bytes read, 0 at the end of the file."""
+        view = memoryview(buffer).cast("B")
+        end = min(position + len(view), self.size)
+        filled = 0
+        while position < end:
+            if position >= self._tail_offset:
+                chunk = memoryview(self._tail)[position - self._tail_offset:end - self._tail_offset]
+            else:
+                index, skip = divmod(position, self.block_size)
+                chunk = memoryview(self._block(index, reader))[skip:skip + end - position]
+            view[filled:filled + len(chunk)] = chunk
+            filled += len(chunk)
+            position += len(chunk)
+        return filled
+
+    def close(self):
+        """Stop pending downloads and close the connections."""
+        self._closed = True
+        self._executor.shutdown(wait=True)
+        self._blocks.clear()
+        self._recent.clear()
+        while not self._idle.empty():
+            self._idle.get_nowait().close()
+
+    def _fetch_tail(self):
+        # The suffix range also tells the size of the file.
+        response, body = self._request(f"bytes=-{HTTP_TAIL_SIZE}")
+        match = _CONTENT_RANGE.match(response.getheader("Content-Range") or "")
+        if response.status != 206 or match is None:
+            raise ValueError(self._error_message(response))
+        self.size = int(match.group(3))
+        self._tail_offset = int(match.group(1))
+        self._tail = body
+        if len(body) != self.size - self._tail_offset:
+            raise ValueError(f"{self.url}: incomplete response.")
+        self._block_count = -(-self._tail_offset // self.block_size)
+
+    def _block(self, index, reader=None):
+        with self._lock:
+            if reader is not None:
+                self._positions[reader] = index
+            future = self._blocks.get(index)
+            if future is None:
+                future = self._submit(index)
+            self._unread.discard(index)
+            self._recent[index] = None
+            self._recent.move_to_end(index)
+            self._release_passed()
+            self._advance_frontier()
+            self._evict()
+        return future.result()
+
+    def _forget_reader(self, reader):
+        with self._lock:
+            self._readers -= 1
+            self._positions.pop(reader, None)
+
+    def _submit(self, index):
+        start = index * self.block_size
+        future = self._blocks[index] = self._executor.submit(self._fetch_range, start, min(start + self.block_size, self._tail_offset))
+        self._fetched.add(index)
+        return future
+
+    def _release_passed(self):
+        # Blocks behind every reader will not be read (their members were skipped); stop holding them for the frontier.
+        if not self._positions:
+            return
+        lowest = min(self._positions.values())
+        for index in [index for index in self._unread if index < lowest]:
+            self._unread.discard(index)
+            self._recent[index] = None
+
+    def _advance_frontier(self):
+        # The frontier is the first block from the slowest reader on that was never downloaded.
+        while self._first_unfetched in self._fetched:
+            self._first_unfetched += 1
+        index = max(min(self._positions.values()) if self._positions else 0, self._first_unfetched)
+        while index < self._block_count and len(self._unread) < self._read_ahead:
+            if index not in self._fetched:
+                self._submit(index)
+                self._unread.add(index)
+            index += 1
+
+    def _evict(self):
+        # Pending downloads are never evicted, nor the block a reader is in: reads are not aligned to blocks.
+        excess = len(self._recent) - max(self._kept_per_reader * self._readers, 1)
+        if excess <= 0:
+            return
+        current = set(self._positions.values())
+        for index in [index for index in self._recent if index not in current and self._blocks[index].done()][:excess]:
+            del self._recent[index]
+            del self._blocks[index]
+
+    def _fetch_range(self, start, end):
+        if self._closed:
+            raise ValueError(f"{self.url}: source is closed.")
+        response, body = self._request(f"bytes={start}-{end - 1}")
+        if response.status != 206:
+            raise ValueError(self._error_message(response))
+        if len(body) != end - start:
+            raise ValueError(f"{self.url}: incomplete response.")
+        return body
+
+    def _request(self, byte_range):
+        """GET `byte_range` on a pooled connection. Returns the response and its body, which is only read for 206 responses."""
+        try:
+            connection = self._idle.get_nowait()
+        except queue.Empty:
+            connection = self._connection_class(*self._address, timeout=self._timeout)
+        for attempt in (1, 2):
+            try:
+                connection.request("GET", self._target, headers={"Range": byte_range})
+                response = connection.getresponse()
+                # Anything but a partial response is an error; do not download a whole file to report it.
+                body = response.read() if response.status == 206 else b""
+                break
+            except (http.client.HTTPException, ConnectionError):
+                # The server may have dropped an idle keep-alive connection; reconnect once.
+                connection.close()
+                if attempt == 2:
+                    raise
+        if response.status != 206 or response.will_close:
+            connection.close()
+        else:
+            self._idle.put(connection)
+        return response, body
+
+    def _error_message(self, response):
+        if response.status == 200:
+            return f"{self.url}: the server does not support range requests."
+        return f"{self.url}: HTTP {response.status} {response.reason}"
+
+class _HttpReader(io.RawIOBase):
+    """Seekable, unbuffered binary reader over an `_HttpSource`, with its own position."""
+
+    def __init__(self, source):
+        self._source = source
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._source.size
+        if offset < 0:
+            raise OSError("Negative seek position.")
+        self._position = offset
+        return offset
+
+    def readinto(self, buffer):
+        length = self._source.readinto_at(self._position, buffer, id(self))
+        self._position += length
+        return length
+
+    def close(self):
+        if not self.closed:
+            self._source._forget_reader(id(self))
+        super().close()
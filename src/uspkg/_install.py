@@ -0,0 +1,255 @@
+import os
+import fnmatch
+import stat
+import shutil
+import hashlib
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .metadata import UspkgFile
+from ._utils import DEFAULT_CHUNK_SIZE, _calculate_sha256
+from ._hashing import read_blocks
+from .instrumentation import NULL_INSTRUMENTATION, _ByteProgress
+
+# Linux ioctl cloning a file's data blocks (btrfs, XFS, ...)
+FICLONE = 0x40049409
+
+def _install(uspkg_file, install_dir, workers=None, update_progress_callback=None, chunk_size=DEFAULT_CHUNK_SIZE, instrumentation=None, store=None, writable=()):
+    """
+    Install the contents of a .uspkg file into `install_dir`.
+
+    The package is assembled in a staging directory next to `install_dir`
+    and swapped into place once every file has been written and checked:
+    - files already installed with the expected hash are hardlinked (or
+      copied) into the staging directory instead of being extracted again,
+    - the other members are decompressed by a pool of `workers` threads, each
+      reading the package through its own decrypting view, and hashed while
+      they are written.
+    With a `Store`, every file goes through the store instead: files whose
+    hash is already stored are linked from it, the others are extracted into
+    it first. Files whose member name matches one of the glob patterns in
+    `writable` are cloned or copied from the store, never hardlinked, since
+    hardlinks share the read-only mode of the stored file.
+    `uspkg_file` may also be an `_HttpSource`, in which case every thread
+    reads the package through its own reader over the shared download.
+    Every file listed in metadata["files"] must be in the archive.
+    If anything fails, the staging directory is removed and `install_dir` is
+    left as it was. Progress is reported as the percentage of bytes installed.
+
+    Returns:
+    tuple: Number of files extracted and number of files reused.
+    """
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    install_dir = os.path.abspath(install_dir)
+    parent_dir = os.path.dirname(install_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+
+    with _open_package(uspkg_file) as package, package.open_zip(chunk_size) as zip_file:
+        files = package.metadata["files"]
+        members = [zinfo for zinfo in zip_file.infolist() if not zinfo.is_dir()]
+    # A damaged central directory can drop members; never install an incomplete tree.
+    missing = files.keys() - {zinfo.filename for zinfo in members}
+    if missing:
+        raise ValueError(f"File missing from package: {min(missing)}")
+    progress = _ByteProgress(sum(zinfo.file_size for zinfo in members), update_progress_callback)
+
+    staging_dir = tempfile.mkdtemp(prefix=os.path.basename(install_dir) + ".staging-", dir=parent_dir)
+    # mkdtemp creates the directory as 0700; give the installed tree the mode a normal directory would have.
+    os.chmod(staging_dir, _directory_mode(install_dir))
+    readers = _ThreadLocalZip(uspkg_file, chunk_size, instrumentation)
+    counts = {"extracted": 0, "reused": 0}
+    lock = threading.Lock()
+    failed = threading.Event()
+
+    def install_member(zinfo):
+        # Once a member has failed, skip the rest of the queue instead of doing useless work.
+        if failed.is_set():
+            return
+        try:
+            install_one(zinfo)
+        except BaseException:
+            failed.set()
+            raise
+
+    def install_one(zinfo):
+        expected_hash = files.get(zinfo.filename)
+        relpath = _member_relpath(zinfo.filename)
+        staged_path = os.path.join(staging_dir, relpath)
+        os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+        installed_path = os.path.join(install_dir, relpath)
+        if store is not None and expected_hash is not None:
+            object_path = store.object_path(expected_hash)
+            if os.path.exists(object_path):
+                progress.advance(zinfo.file_size)
+                outcome = "reused"
+            else:
+                temp_path = store.temp_path()
+                try:
+                    _write_member(readers.get(), zinfo, temp_path, expected_hash, chunk_size, instrumentation, progress)
+                    store.add_object(temp_path, expected_hash)
+                except BaseException:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+                outcome = "extracted"
+            _clone_or_link(object_path, staged_path, link=not _matches_any(zinfo.filename, writable))
+        elif expected_hash is not None and _is_installed(installed_path, zinfo.file_size, expected_hash, instrumentation):
+            _link_or_copy(installed_path, staged_path)
+            progress.advance(zinfo.file_size)
+            outcome = "reused"
+        else:
+            _write_member(readers.get(), zinfo, staged_path, expected_hash, chunk_size, instrumentation, progress)
+            outcome = "extracted"
+        with lock:
+            counts[outcome] += 1
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # list() re-raises the first error from the workers.
+            list(executor.map(install_member, members))
+        if not members:
+            progress.advance(0)
+        readers.close()
+        _swap_into_place(staging_dir, install_dir)
+    except BaseException:
+        readers.close()
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+    return counts["extracted"], counts["reused"]
+
+def _open_package(source):
+    """Open a package from a path, or from an `_HttpSource` through a new reader."""
+    if hasattr(source, "open"):
+        return UspkgFile(source.open())
+    return UspkgFile(source)
+
+class _ThreadLocalZip:
+    """Gives each thread its own file handle and `ZipFile` over a package, so reads never contend on a seek position."""
+
+    def __init__(self, uspkg_file, chunk_size=DEFAULT_CHUNK_SIZE, instrumentation=None):
+        self._uspkg_file = uspkg_file
+        self._chunk_size = chunk_size
+        self._instrumentation = instrumentation
+        self._local = threading.local()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        zip_file = getattr(self._local, "zip_file", None)
+        if zip_file is None:
+            package = _open_package(self._uspkg_file)
+            zip_file = package.open_zip(self._chunk_size, self._instrumentation)
+            self._local.zip_file = zip_file
+            with self._lock:
+                self._opened.append((zip_file, package))
+        return zip_file
+
+    def close(self):
+        with self._lock:
+            for zip_file, package in self._opened:
+                zip_file.close()
+                package.close()
+            self._opened.clear()
+
+def _member_relpath(name):
+    """Turn a member name into a safe relative path, the same way `ZipFile.extract` does."""
+    name = os.path.splitdrive(name.replace('/', os.path.sep))[1]
+    parts = [part for part in name.split(os.path.sep) if part not in ('', os.path.curdir, os.path.pardir)]
+    if not parts:
+        raise ValueError(f"Invalid member name: {name}")
+    return os.path.join(*parts)
+
+def _is_installed(path, size, expected_hash, instrumentation=NULL_INSTRUMENTATION):
+    try:
+        if os.path.getsize(path) != size:
+            return False
+    except OSError:
+        return False
+    with instrumentation.stage("hash", size, files=1):
+        return _calculate_sha256(path) == expected_hash
+
+def _link_or_copy(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def _clone_or_link(src, dst, link=True):
+    """
+    Give `dst` the content of `src`: as a copy-on-write clone where supported,
+    else as a hardlink (unless `link` is False), else as a copy. Clones and
+    copies are independent, writable files; a hardlink is `src` itself.
+    """
+    try:
+        _reflink(src, dst)
+        return
+    except OSError:
+        pass
+    if link:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+
+def _matches_any(name, patterns):
+    return any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns)
+
+def _reflink(src, dst):
+    try:
+        import fcntl
+    except ImportError:
+        raise OSError("Reflinks are not supported on this platform.") from None
+    try:
+        with open(src, 'rb') as src_file, open(dst, 'wb') as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        raise
+
+def _write_member(zip_file, zinfo, path, expected_hash, chunk_size=DEFAULT_CHUNK_SIZE, instrumentation=NULL_INSTRUMENTATION, progress=None):
+    """Decompress a member to `path`, checking its hash as it is written."""
+    sha256_hash = hashlib.sha256()
+    with zip_file.open(zinfo) as src, open(path, 'wb') as dst:
+        blocks = read_blocks(src, chunk_size)
+        while True:
+            # Reading and decrypting the package are timed as their own stages.
+            with instrumentation.stage("extract") as span:
+                block = next(blocks, None)
+                span.bytes = len(block) if block is not None else 0
+            if block is None:
+                break
+            with instrumentation.stage("hash", len(block)):
+                sha256_hash.update(block)
+            with instrumentation.stage("write", len(block)):
+                dst.write(block)
+            if progress:
+                progress.advance(len(block))
+    instrumentation.add_files("extract")
+    if expected_hash is not None and sha256_hash.hexdigest() != expected_hash:
+        raise ValueError(f"Hash mismatch for {zinfo.filename}.")
+
+def _directory_mode(install_dir):
+    """Mode for a new `install_dir`: the mode of the existing one, or 0777 masked by the umask."""
+    if os.path.isdir(install_dir):
+        return stat.S_IMODE(os.stat(install_dir).st_mode)
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o777 & ~umask
+
+def _swap_into_place(staging_dir, install_dir):
+    """Replace `install_dir` with `staging_dir`, keeping the old tree until the new one is in place."""
+    if not os.path.exists(install_dir):
+        os.rename(staging_dir, install_dir)
+        return
+    backup_dir = tempfile.mkdtemp(prefix=os.path.basename(install_dir) + ".old-", dir=os.path.dirname(install_dir))
+    os.rmdir(backup_dir)
+    os.rename(install_dir, backup_dir)
+    try:
+        os.rename(staging_dir, install_dir)
+    except BaseException:
+        os.rename(backup_dir, install_dir)
+        raise
+    shutil.rmtree(backup_dir, ignore_errors=True)
@@ -1,22 +1,42 @@
 import hashlib
-import base64
+import io
+from ._hashing import sha256 as _calculate_sha256, read_blocks
 
-HASH_BLOCK_SIZE = 4096
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+THUMBNAIL_SIZE = (300, 300)
+VERIFY_LEVELS = ("trailer", "container", "full")
 
-def _calculate_sha256(file_path):
-    sha256_hash = hashlib.sha256()
-    with open(file_path, "rb") as f:
-        for byte_block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
-            sha256_hash.update(byte_block)
-    return sha256_hash.hexdigest()
-
-def _verify_file_in_zip(zip_file, file_name, expected_hash):
+def _verify_file_in_zip(zip_file, file_name, expected_hash, instrumentation=None):
+    if instrumentation is None:
+        # Imported here so that reading metadata, which needs this module, stays light.
+        from .instrumentation import NULL_INSTRUMENTATION as instrumentation
     with zip_file.open(file_name) as file:
         sha256_hash = hashlib.sha256()
-        for byte_block in iter(lambda: file.read(HASH_BLOCK_SIZE), b""):
-            sha256_hash.update(byte_block)
-        return sha256_hash.hexdigest() == expected_hash
+        blocks = read_blocks(file)
+        while True:
+            with instrumentation.stage("extract") as span:
+                byte_block = next(blocks, None)
+                span.bytes = len(byte_block) if byte_block is not None else 0
+            if byte_block is None:
+                break
+            with instrumentation.stage("hash", len(byte_block)):
+                sha256_hash.update(byte_block)
+    instrumentation.add_files("hash")
+    return sha256_hash.hexdigest() == expected_hash
 
-def _encode_image_to_base64(image_path):
+def _read_image(image_path):
     with open(image_path, 'rb') as img_file:
-        return base64.b64encode(img_file.read()).decode('utf-8')
+        return img_file.read()
+
+def _make_thumbnail(image_data, size=THUMBNAIL_SIZE):
+    """Render a small preview of an image: PNG if it has transparency, JPEG otherwise."""
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_data)) as image:
+        image.thumbnail(size)
+        output = io.BytesIO()
+        if image.mode in ("RGBA", "LA", "P"):
+            image.save(output, format="PNG", optimize=True)
+        else:
+            image.convert("RGB").save(output, format="JPEG", quality=85)
+    return output.getvalue()
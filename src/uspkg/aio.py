@@ -0,0 +1,140 @@
+"""
+asyncio front end for creating, verifying, extracting and installing .uspkg files.
+
+Each operation is an async generator of events: `ProgressEvent`s while it
+runs, then a single `DoneEvent`. The blocking work (file I/O, compression,
+hashing and crypto, all done in chunks) runs in `executor`, or in the loop's
+default executor. Progress is delivered on the event loop, never from a
+worker thread.
+
+Cancelling the task that iterates over an operation, or closing the
+generator with `aclose()`, stops the worker at its next progress report and
+removes any partial output before the cancellation propagates::
+
+    async for event in uspkg.aio.create(folder, "game.uspkg", ...):
+        if isinstance(event, uspkg.aio.ProgressEvent):
+            print(f"{event.percent:.0f}%")
+"""
+import asyncio
+import functools
+import threading
+from dataclasses import dataclass
+from typing import Any, Optional
+from . import uspkg as _uspkg
+from ._utils import DEFAULT_CHUNK_SIZE
+
+@dataclass(frozen=True)
+class ProgressEvent:
+    """Progress of a running operation."""
+    operation: str
+    percent: float
+
+@dataclass(frozen=True)
+class DoneEvent:
+    """Final event of an operation. `error` is set when verification failed."""
+    operation: str
+    result: Any
+    error: Optional[str] = None
+
+class _Cancelled(Exception):
+    """Raised from the progress callback to stop a worker whose task was cancelled."""
+
+def create(folder_path, output_file, title, description, image_path, _type, main_exe, *, executor=None, **kwargs):
+    """
+    Create a .uspkg file, see `create_encrypted_uspkg_with_uid` for the arguments.
+
+    The result of the `DoneEvent` is `output_file`. On cancellation the partial
+    output file is removed.
+    """
+    def run(update_progress_callback):
+        _uspkg.create_encrypted_uspkg_with_uid(
+            folder_path, output_file, title, description, image_path, _type, main_exe,
+            update_progress_callback=update_progress_callback, **kwargs
+        )
+        return output_file, None
+    return _run("create", run, executor)
+
+def verify(uspkg_file, uid=None, level="full", *, executor=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Verify a .uspkg file, see `verify_uspkg_file` for the arguments.
+
+    The result of the `DoneEvent` is True or False; when False, `error` holds
+    the reason.
+    """
+    if level not in _uspkg.VERIFY_LEVELS:
+        raise ValueError(f"Unknown verification level: {level}")
+
+    def run(update_progress_callback):
+        try:
+            _uspkg._verify_uspkg(uspkg_file, uid, level, chunk_size, update_progress_callback)
+        except _Cancelled:
+            raise
+        except Exception as e:
+            return False, str(e) or type(e).__name__
+        return True, None
+    return _run("verify", run, executor)
+
+def extract(uspkg_file, output_dir, *, executor=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Extract a .uspkg file into `output_dir`, see `extract_encrypted_uspkg_with_uid`.
+
+    Like the synchronous version, files are only added to `output_dir` (or
+    overwrite files of the same name); nothing else in it is touched. The
+    result of the `DoneEvent` is `output_dir`. On cancellation the files the
+    extraction created are removed.
+    """
+    def run(update_progress_callback):
+        _uspkg._extract(uspkg_file, output_dir, update_progress_callback, chunk_size=chunk_size)
+        return output_dir, None
+    return _run("extract", run, executor)
+
+def install(uspkg_file, install_dir, *, executor=None, workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Install a .uspkg file into `install_dir`, see `install_uspkg`.
+
+    `install_dir` is replaced by the package contents: files in it that are
+    not part of the package are removed. The result of the `DoneEvent` is the
+    (extracted, reused) file counts. Files are staged next to `install_dir`,
+    so a cancelled install leaves it untouched.
+    """
+    def run(update_progress_callback):
+        return _uspkg.install_uspkg(uspkg_file, install_dir, workers, update_progress_callback, chunk_size), None
+    return _run("install", run, executor)
+
+async def _run(operation, func, executor):
+    """Run `func(update_progress_callback)` in `executor` and turn its progress into events."""
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def update_progress(percent):
+        if cancelled.is_set():
+            raise _Cancelled()
+        loop.call_soon_threadsafe(events.put_nowait, ProgressEvent(operation, percent))
+
+    future = loop.run_in_executor(executor, functools.partial(func, update_progress))
+    next_event = None
+    try:
+        while not future.done():
+            next_event = asyncio.ensure_future(events.get())
+            await asyncio.wait({next_event, future}, return_when=asyncio.FIRST_COMPLETED)
+            if next_event.done():
+                yield next_event.result()
+            else:
+                next_event.cancel()
+        # Progress reported before the worker returned was queued before its
+        # result was set, so it is already waiting here.
+        while not events.empty():
+            yield events.get_nowait()
+        result, error = future.result()
+        yield DoneEvent(operation, result, error)
+    finally:
+        if next_event is not None and not next_event.done():
+            next_event.cancel()
+        if not future.done():
+            # Stop the worker at its next progress report; it removes its
+            # partial output on the way out.
+            cancelled.set()
+            await asyncio.wait({future})
+            if not future.cancelled():
+                future.exception()
@@ -0,0 +1,182 @@
+import os
+import sqlite3
+import time
+from .metadata import read_uspkg_trailer
+from .uspkg import VERIFY_LEVELS, _find_packages, _open_payload_zip, _verify_for_batch, verify_packages
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS packages (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    uid TEXT,
+    title TEXT,
+    description TEXT,
+    type TEXT,
+    main_exe TEXT,
+    file_count INTEGER,
+    installed_size INTEGER,
+    zip_encrypted_hash TEXT,
+    verified_ok INTEGER,
+    verified_reason TEXT,
+    verified_level TEXT,
+    verified_at REAL
+);
+CREATE INDEX IF NOT EXISTS packages_title ON packages (title);
+CREATE INDEX IF NOT EXISTS packages_uid ON packages (uid);
+"""
+
+class Catalog:
+    """
+    Local SQLite index of .uspkg metadata and verification results.
+
+    Entries are keyed by path and remember the size and mtime the package had
+    when it was indexed. `scan` only re-reads packages whose size or mtime
+    changed, and `list`/`search` never open package files. Verification
+    results are cached until the package changes.
+
+    `zip_encrypted_hash` is NULL for format version 2 packages, which
+    authenticate each segment instead of recording a hash of the payload.
+    """
+
+    def __init__(self, db_path):
+        self._db = sqlite3.connect(db_path)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def scan(self, directory):
+        """
+        Bring the index up to date with the .uspkg files under `directory`.
+
+        Returns:
+        tuple: Number of packages (re)indexed and number of entries removed.
+        """
+        directory = os.path.abspath(directory)
+        indexed = 0
+        seen = set()
+        with self._db:
+            for path in _find_packages(directory):
+                path = os.path.abspath(path)
+                seen.add(path)
+                if self._refresh(path):
+                    indexed += 1
+            prefix = os.path.join(directory, "")
+            stale = [
+                row["path"] for row in self._db.execute("SELECT path FROM packages WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))
+                if row["path"] not in seen
+            ]
+            self._db.executemany("DELETE FROM packages WHERE path = ?", [(path,) for path in stale])
+        return indexed, len(stale)
+
+    def add(self, uspkg_file):
+        """Index a single package if it is new or has changed. Returns True if it was (re)indexed."""
+        with self._db:
+            return self._refresh(os.path.abspath(uspkg_file))
+
+    def get(self, uspkg_file):
+        """Return the catalog entry of a package as a dict, or None."""
+        row = self._db.execute("SELECT * FROM packages WHERE path = ?", (os.path.abspath(uspkg_file),)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, _type=None):
+        """Return every indexed package, optionally only those of a given type, ordered by title."""
+        if _type is None:
+            rows = self._db.execute("SELECT * FROM packages ORDER BY title")
+        else:
+            rows = self._db.execute("SELECT * FROM packages WHERE type = ? ORDER BY title", (_type,))
+        return [dict(row) for row in rows]
+
+    def search(self, text):
+        """Return the packages whose title or description contains `text` (case-insensitive)."""
+        pattern = "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        rows = self._db.execute(
+            "SELECT * FROM packages WHERE title LIKE ? ESCAPE '\\' OR description LIKE ? ESCAPE '\\' ORDER BY title",
+            (pattern, pattern)
+        )
+        return [dict(row) for row in rows]
+
+    def verify(self, uspkg_file, level="full"):
+        """
+        Verify a package, answering from the cache if it has not changed since
+        it was last verified at `level` or deeper.
+
+        Returns:
+        dict: The catalog entry, including the verification result.
+        """
+        path = os.path.abspath(uspkg_file)
+        self.add(path)
+        entry = self.get(path)
+        if not _has_cached_result(entry, level):
+            self._store_result(_verify_for_batch(path, level), level)
+            entry = self.get(path)
+        return entry
+
+    def verify_all(self, jobs=None, level="full"):
+        """
+        Verify every indexed package that has no cached result at `level`, on a
+        pool of processes. Yields the fresh results, see `verify_directory`.
+        """
+        paths = [entry["path"] for entry in self.list() if not _has_cached_result(entry, level)]
+        for result in verify_packages(paths, jobs, level):
+            self._store_result(result, level)
+            yield result
+
+    def _refresh(self, path):
+        stat = os.stat(path)
+        row = self._db.execute("SELECT size, mtime_ns FROM packages WHERE path = ?", (path,)).fetchone()
+        if row and row["size"] == stat.st_size and row["mtime_ns"] == stat.st_mtime_ns:
+            return False
+
+        try:
+            _, metadata = read_uspkg_trailer(path)
+            # The central directory sits at the end of the payload, so this
+            # only decrypts a few kilobytes.
+            with _open_payload_zip(path) as (zip_file, _):
+                installed_size = sum(zinfo.file_size for zinfo in zip_file.infolist())
+        except Exception as e:
+            # Keep unreadable packages in the index as failed so they are not re-read on every scan.
+            self._db.execute(
+                "INSERT OR REPLACE INTO packages (path, size, mtime_ns, verified_ok, verified_reason, verified_level, verified_at) "
+                "VALUES (?, ?, ?, 0, ?, ?, ?)",
+                (path, stat.st_size, stat.st_mtime_ns, str(e) or type(e).__name__, VERIFY_LEVELS[-1], time.time())
+            )
+            return True
+        self._db.execute(
+            "INSERT OR REPLACE INTO packages "
+            "(path, size, mtime_ns, uid, title, description, type, main_exe, file_count, installed_size, zip_encrypted_hash) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                path, stat.st_size, stat.st_mtime_ns,
+                metadata.get("UID"), metadata.get("title"), metadata.get("description"),
+                metadata.get("type"), metadata.get("mainExe"), len(metadata.get("files", {})),
+                installed_size, metadata.get("zipEncryptedHash"),
+            )
+        )
+        return True
+
+    def _store_result(self, result, level):
+        with self._db:
+            self._db.execute(
+                "UPDATE packages SET verified_ok = ?, verified_reason = ?, verified_level = ?, verified_at = ? WHERE path = ?",
+                (int(result["ok"]), result["reason"], level, time.time(), result["path"])
+            )
+
+def _has_cached_result(entry, level):
+    if entry is None or entry["verified_at"] is None:
+        return False
+    try:
+        stat = os.stat(entry["path"])
+    except OSError:
+        return False
+    if (stat.st_size, stat.st_mtime_ns) != (entry["size"], entry["mtime_ns"]):
+        return False
+    return VERIFY_LEVELS.index(entry["verified_level"]) >= VERIFY_LEVELS.index(level)
@@ -0,0 +1,186 @@
+"""
+Per-stage timing and throughput instrumentation.
+
+The create, verify and extract paths accept an `instrumentation` argument and
+report every block of work they do as a `StageEvent`: which stage it belongs
+to, how many bytes it covered, how long it took and how many files it
+completed. Stages nest: when a stage runs inside another one on the same
+thread (e.g. encryption inside compression, because the compressor writes
+into the encryptor), its time is excluded from the outer stage, so the time
+of a stage is the time spent in that stage alone.
+
+`StageCollector` aggregates the events into a per-stage breakdown that can be
+printed or exported as JSON.
+"""
+import json
+import threading
+import time
+from dataclasses import dataclass
+
+STAGES = ("scan", "read", "hash", "compress", "encrypt", "write", "decrypt", "extract")
+
+@dataclass(frozen=True)
+class StageEvent:
+    """A block of work done in one stage."""
+    stage: str
+    bytes: int
+    seconds: float
+    files: int = 0
+
+class _Span:
+    __slots__ = ("bytes", "files")
+
+    def __init__(self, nbytes=0, files=0):
+        self.bytes = nbytes
+        self.files = files
+
+class Instrumentation:
+    """
+    Receives the `StageEvent`s of an operation and passes them to `callback`.
+
+    Subclass it and override `emit`, or pass a callback, to consume events.
+    Events may be emitted from worker threads.
+    """
+
+    def __init__(self, callback=None):
+        self._callback = callback
+        self._local = threading.local()
+
+    def emit(self, event):
+        if self._callback:
+            self._callback(event)
+
+    def stage(self, name, nbytes=0, files=0):
+        """
+        Context manager timing a block of work in stage `name`.
+
+        It yields a span whose `bytes` and `files` can be updated inside the
+        block, for when the amount of work is only known afterwards.
+        """
+        return _StageTimer(self, name, nbytes, files)
+
+    def add_files(self, name, count=1):
+        """Record files completed in stage `name` without timing anything."""
+        self.emit(StageEvent(name, 0, 0.0, count))
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+class _StageTimer:
+    __slots__ = ("_instrumentation", "_name", "_span", "_start")
+
+    def __init__(self, instrumentation, name, nbytes, files):
+        self._instrumentation = instrumentation
+        self._name = name
+        self._span = _Span(nbytes, files)
+
+    def __enter__(self):
+        self._instrumentation._stack().append(0.0)
+        self._start = time.perf_counter()
+        return self._span
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsed = time.perf_counter() - self._start
+        stack = self._instrumentation._stack()
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        self._instrumentation.emit(StageEvent(self._name, self._span.bytes, elapsed - nested, self._span.files))
+
+class _NullInstrumentation:
+    """Instrumentation that records nothing, used when none is given."""
+
+    def emit(self, event):
+        pass
+
+    def stage(self, name, nbytes=0, files=0):
+        return _NULL_TIMER
+
+    def add_files(self, name, count=1):
+        pass
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return _Span()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NULL_TIMER = _NullTimer()
+NULL_INSTRUMENTATION = _NullInstrumentation()
+
+class StageCollector(Instrumentation):
+    """
+    Instrumentation that sums up bytes, time and files per stage.
+
+    Wall time runs from the creation of the collector to the last event.
+    """
+
+    def __init__(self, callback=None):
+        super().__init__(callback)
+        self._lock = threading.Lock()
+        self._totals = {}
+        self._start = time.perf_counter()
+        self._end = self._start
+
+    def emit(self, event):
+        with self._lock:
+            total = self._totals.setdefault(event.stage, {"bytes": 0, "seconds": 0.0, "files": 0})
+            total["bytes"] += event.bytes
+            total["seconds"] += event.seconds
+            total["files"] += event.files
+            self._end = time.perf_counter()
+        super().emit(event)
+
+    def summary(self):
+        """Return {"wall_seconds": ..., "stages": {stage: {"bytes", "seconds", "files", "mb_per_second"}}}."""
+        with self._lock:
+            stages = {}
+            for stage in sorted(self._totals, key=_stage_order):
+                total = dict(self._totals[stage])
+                total["mb_per_second"] = round(total["bytes"] / (1024 * 1024) / total["seconds"], 2) if total["seconds"] else None
+                total["seconds"] = round(total["seconds"], 6)
+                stages[stage] = total
+            return {"wall_seconds": round(self._end - self._start, 6), "stages": stages}
+
+    def report(self):
+        """Return the per-stage breakdown as a printable table."""
+        summary = self.summary()
+        wall = summary["wall_seconds"]
+        lines = [f"{'stage':<10}{'seconds':>10}{'share':>8}{'MB':>12}{'MB/s':>10}{'files':>8}"]
+        for stage, total in summary["stages"].items():
+            share = f"{total['seconds'] / wall:.0%}" if wall else "-"
+            speed = f"{total['mb_per_second']:.1f}" if total["mb_per_second"] is not None else "-"
+            lines.append(f"{stage:<10}{total['seconds']:>10.3f}{share:>8}{total['bytes'] / (1024 * 1024):>12.1f}{speed:>10}{total['files']:>8}")
+        lines.append(f"{'wall':<10}{wall:>10.3f}")
+        return "\n".join(lines)
+
+    def to_json(self, path):
+        """Write the summary to `path` as JSON."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+
+def _stage_order(stage):
+    return STAGES.index(stage) if stage in STAGES else len(STAGES)
+
+class _ByteProgress:
+    """Turns bytes processed into a percentage of `total_bytes` for an update_progress_callback."""
+
+    def __init__(self, total_bytes, callback=None):
+        self._total_bytes = total_bytes
+        self._callback = callback
+        self._done = 0
+        self._lock = threading.Lock()
+
+    def advance(self, nbytes):
+        if not self._callback:
+            return
+        # Report under the lock, so threads finishing blocks at the same time never deliver percentages out of order.
+        with self._lock:
+            self._done += nbytes
+            self._callback(min(self._done / self._total_bytes * 100, 100.0) if self._total_bytes else 100.0)
@@ -1,29 +1,287 @@
 import msgpack
+import base64
+import io
+import mmap
 import os
+from ._utils import DEFAULT_CHUNK_SIZE
 
 METADATA_SIZE_BYTES = 8
 AES_BLOCK_SIZE = 16
+GCM_TAG_SIZE = 16
+FORMAT_VERSIONS = (1, 2)
+EDIT_JOURNAL_SUFFIX = ".edit"
 
 def write_uspkg(output_file, encrypted_zip_data, iv, metadata):
-    packed_msgpack = msgpack.packb(metadata, use_bin_type=True)
     with open(output_file, 'wb') as f_out:
         f_out.write(encrypted_zip_data)
-        f_out.write(iv)
-        f_out.write(packed_msgpack)
-        f_out.write(len(packed_msgpack).to_bytes(METADATA_SIZE_BYTES, 'big'))
+        write_uspkg_trailer(f_out, iv, metadata)
 
-def read_uspkg_metadata(uspkg_file):
+def write_uspkg_trailer(f_out, iv, metadata):
+    """Append the IV, the packed metadata and its length at the current position of `f_out`."""
+    f_out.write(_pack_trailer(iv, metadata))
+
+def _pack_trailer(iv, metadata):
+    packed_msgpack = msgpack.packb(metadata, use_bin_type=True)
+    return iv + packed_msgpack + len(packed_msgpack).to_bytes(METADATA_SIZE_BYTES, 'big')
+
+class UspkgFile:
+    """
+    An open .uspkg file.
+
+    The IV and metadata are read from the trailer when the file is opened. The
+    encrypted payload is left on disk and only read through `read_payload`,
+    `payload_view` or by seeking the underlying file within
+    `payload_offset`/`payload_size`.
+
+    Version 1 payloads are a single AES-CFB stream. Version 2 payloads are a
+    sequence of AES-GCM segments described by metadata["segments"], see
+    `_SegmentEncryptingWriter`.
+
+    `uspkg_file` is a path, or a seekable binary file object that the
+    `UspkgFile` then owns and closes.
+    """
+
+    def __init__(self, uspkg_file):
+        self.payload_offset = 0
+        if hasattr(uspkg_file, "read"):
+            self.path = getattr(uspkg_file, "name", None)
+            self._file = uspkg_file
+        else:
+            self.path = uspkg_file
+            self._file = open(uspkg_file, 'rb')
+        self._mmap = None
+        try:
+            self.payload_size, self.iv, self.metadata = _read_trailer(self._file)
+            self.format_version = get_format_version(self.metadata)
+            if self.format_version == 2:
+                _check_segments(self.metadata["segments"], self.payload_size)
+        except BaseException:
+            self._file.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    @property
+    def fileobj(self):
+        """The underlying binary file object."""
+        return self._file
+
+    def read_payload(self):
+        """Read the whole encrypted payload into memory."""
+        self._file.seek(self.payload_offset)
+        return self._file.read(self.payload_size)
+
+    def payload_view(self):
+        """
+        Return a read-only memoryview of the encrypted payload backed by mmap.
+
+        Views must be released before the file is closed.
+        """
+        if self.payload_size == 0:
+            return memoryview(b"")
+        if self._mmap is None:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return memoryview(self._mmap)[self.payload_offset:self.payload_offset + self.payload_size]
+
+    def open_decrypted(self, chunk_size=DEFAULT_CHUNK_SIZE, uid=None, instrumentation=None):
+        """
+        Return a seekable, buffered binary stream over the decrypted payload.
+
+        Only the parts that are actually read get decrypted. The stream shares
+        the underlying file, so it must not be used after the file is closed.
+        """
+        return io.BufferedReader(self.open_raw_decrypted(uid, instrumentation=instrumentation), buffer_size=chunk_size)
+
+    def open_raw_decrypted(self, uid=None, progress_callback=None, instrumentation=None):
+        """
+        Return the unbuffered decrypting reader for the payload's format version.
+
+        For version 2 payloads this is a `_SegmentDecryptingReader`, which
+        authenticates every segment it reads.
+        """
+        from ._encryption import _generate_key_from_uid, _DecryptingReader, _SegmentDecryptingReader
+
+        key = _generate_key_from_uid(uid or self.metadata["UID"])
+        if self.format_version == 2:
+            segments = self.metadata["segments"]
+            return _SegmentDecryptingReader(
+                self._file, key, self.iv, segments["size"], segments["plainSize"], self.payload_offset,
+                progress_callback, instrumentation
+            )
+        return _DecryptingReader(self._file, key, self.iv, self.payload_size, self.payload_offset, instrumentation)
+
+    def open_zip(self, chunk_size=DEFAULT_CHUNK_SIZE, instrumentation=None):
+        """Open the decrypted payload as a `zipfile.ZipFile`."""
+        import zipfile
+
+        return zipfile.ZipFile(self.open_decrypted(chunk_size, instrumentation=instrumentation), 'r')
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+def read_uspkg_trailer(uspkg_file):
+    """Read the IV and metadata of a .uspkg file without reading its payload."""
     with open(uspkg_file, 'rb') as f_in:
-        f_in.seek(0, os.SEEK_END)
-        file_size = f_in.tell()
-        f_in.seek(-METADATA_SIZE_BYTES, os.SEEK_END)
-        metadata_length = int.from_bytes(f_in.read(METADATA_SIZE_BYTES), 'big')
-        encrypted_data_size = file_size - (metadata_length + METADATA_SIZE_BYTES + AES_BLOCK_SIZE)
-        f_in.seek(file_size - (metadata_length + METADATA_SIZE_BYTES + AES_BLOCK_SIZE))
-        iv = f_in.read(AES_BLOCK_SIZE)
-        f_in.seek(file_size - (metadata_length + METADATA_SIZE_BYTES))
-        packed_msgpack = f_in.read(metadata_length)
-        f_in.seek(0)
-        encrypted_zip_data = f_in.read(encrypted_data_size)
-        metadata = msgpack.unpackb(packed_msgpack, raw=False)
-    return encrypted_zip_data, iv, metadata
+        _, iv, metadata = _read_trailer(f_in)
+    return iv, metadata
+
+def get_image_data(metadata, prefer_thumbnail=True):
+    """
+    Return the bytes of a package's image, or None if it has none.
+
+    The pre-rendered thumbnail is returned when there is one, unless
+    `prefer_thumbnail` is False. Images of older packages, stored as base64
+    text, are decoded transparently.
+    """
+    image = metadata.get("thumbnail") if prefer_thumbnail else None
+    if not image:
+        image = metadata.get("image")
+    if not image:
+        return None
+    if isinstance(image, str):
+        return base64.b64decode(image)
+    return image
+
+def get_format_version(metadata):
+    """Return the container format version of a package, raising ValueError if it is not supported."""
+    version = metadata.get("formatVersion", 1)
+    if version not in FORMAT_VERSIONS:
+        raise ValueError(f"Unsupported .uspkg format version: {version}")
+    return version
+
+def read_uspkg_metadata(uspkg_file):
+    """
+    Read the encrypted payload, IV and metadata of a .uspkg file.
+
+    The payload is returned as stored; metadata["formatVersion"] (1 when
+    absent) tells how it is encrypted.
+    """
+    with UspkgFile(uspkg_file) as package:
+        return package.read_payload(), package.iv, package.metadata
+
+def _read_trailer(f_in):
+    """Read the trailer of an open .uspkg file. Returns the payload size, the IV and the metadata."""
+    try:
+        return _parse_trailer(f_in)
+    except Exception:
+        # An interrupted metadata edit leaves a journal holding the size the file had before it.
+        previous_size = _read_edit_journal(getattr(f_in, "name", None))
+        if previous_size is None:
+            raise
+        return _parse_trailer(f_in, previous_size)
+
+def _parse_trailer(f_in, file_size=None):
+    if file_size is None:
+        file_size = f_in.seek(0, os.SEEK_END)
+    f_in.seek(file_size - METADATA_SIZE_BYTES)
+    metadata_length = int.from_bytes(f_in.read(METADATA_SIZE_BYTES), 'big')
+    trailer_offset = file_size - (metadata_length + METADATA_SIZE_BYTES + AES_BLOCK_SIZE)
+    if trailer_offset < 0:
+        raise ValueError("Invalid .uspkg file: metadata length exceeds file size.")
+    f_in.seek(trailer_offset)
+    trailer = f_in.read(AES_BLOCK_SIZE + metadata_length)
+    iv = trailer[:AES_BLOCK_SIZE]
+    metadata = msgpack.unpackb(trailer[AES_BLOCK_SIZE:], raw=False)
+    # The recovery copy written while editing a trailer records where the payload ends.
+    encrypted_data_size = metadata.get("payloadSize", trailer_offset)
+    if not 0 <= encrypted_data_size <= trailer_offset:
+        raise ValueError("Invalid .uspkg file: payload size exceeds file size.")
+    return encrypted_data_size, iv, metadata
+
+def _replace_trailer(uspkg_file, payload_size, iv, metadata):
+    """
+    Replace the trailer of a .uspkg file without touching its payload.
+
+    The file ends up laid out exactly like a freshly written package: the new
+    trailer right after the payload, and nothing behind it. To stay valid if
+    the edit is interrupted, a recovery copy of the new trailer, which records
+    the payload size, is first written and synced past both the current end
+    of the file and the end of the new trailer, so that neither the old
+    trailer nor the final one overlaps it. The final trailer is then written
+    after the payload and the file truncated behind it. A journal holding the
+    previous file size covers a crash while writing the recovery copy;
+    readers fall back to it when the end of the file does not hold a valid
+    trailer.
+    """
+    metadata = {key: value for key, value in metadata.items() if key != "payloadSize"}
+    trailer = _pack_trailer(iv, metadata)
+    recovery_trailer = _pack_trailer(iv, dict(metadata, payloadSize=payload_size))
+    with open(uspkg_file, 'r+b') as f:
+        file_size = f.seek(0, os.SEEK_END)
+        _write_edit_journal(uspkg_file, file_size)
+        f.seek(max(file_size, payload_size + len(trailer)))
+        f.write(recovery_trailer)
+        _sync(f)
+        f.seek(payload_size)
+        f.write(trailer)
+        _sync(f)
+        f.truncate(payload_size + len(trailer))
+        _sync(f)
+    _remove_edit_journal(uspkg_file)
+
+def _recover_edit(uspkg_file):
+    """Finish or roll back a metadata edit that was interrupted, if there is one."""
+    previous_size = _read_edit_journal(uspkg_file)
+    if previous_size is None:
+        return
+    with open(uspkg_file, 'r+b') as f:
+        try:
+            payload_size, iv, metadata = _parse_trailer(f)
+        except Exception:
+            # The recovery copy was not completely written: go back to the old trailer.
+            f.truncate(previous_size)
+            _sync(f)
+            metadata = None
+    _remove_edit_journal(uspkg_file)
+    if metadata is not None and "payloadSize" in metadata:
+        # The file ends with the recovery copy: write the final trailer after the payload.
+        _replace_trailer(uspkg_file, payload_size, iv, metadata)
+
+def _read_edit_journal(uspkg_file):
+    if uspkg_file is None:
+        return None
+    try:
+        with open(uspkg_file + EDIT_JOURNAL_SUFFIX, 'rb') as f:
+            return int.from_bytes(f.read(METADATA_SIZE_BYTES), 'big')
+    except OSError:
+        return None
+
+def _write_edit_journal(uspkg_file, file_size):
+    with open(uspkg_file + EDIT_JOURNAL_SUFFIX, 'wb') as f:
+        f.write(file_size.to_bytes(METADATA_SIZE_BYTES, 'big'))
+        _sync(f)
+    _sync_dir(os.path.dirname(os.path.abspath(uspkg_file)))
+
+def _remove_edit_journal(uspkg_file):
+    os.remove(uspkg_file + EDIT_JOURNAL_SUFFIX)
+    _sync_dir(os.path.dirname(os.path.abspath(uspkg_file)))
+
+def _sync(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+def _sync_dir(directory):
+    # Makes the creation or removal of the journal durable; directories cannot be opened on Windows.
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _check_segments(segments, payload_size):
+    """Check that the segment table of a version 2 package matches the size of its payload."""
+    size, count, plain_size = segments["size"], segments["count"], segments["plainSize"]
+    if size <= 0 or count != max(1, -(-plain_size // size)) or payload_size != plain_size + count * GCM_TAG_SIZE:
+        raise ValueError("Invalid .uspkg file: segment table does not match the payload.")
@@ -0,0 +1,205 @@
+import os
+import shutil
+import sqlite3
+import stat
+import string
+import tempfile
+import time
+from ._install import _install, _open_package
+from ._utils import DEFAULT_CHUNK_SIZE
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS installs (
+    install_dir TEXT PRIMARY KEY,
+    uid TEXT,
+    title TEXT,
+    installed_at REAL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    install_dir TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (install_dir, hash)
+);
+CREATE INDEX IF NOT EXISTS refs_hash ON refs (hash);
+"""
+
+class Store:
+    """
+    Content-addressed store of installed files, shared by every package installed through it.
+
+    Files are stored once under their SHA-256 (the hashes recorded in
+    metadata["files"]) and installed as copy-on-write clones where the
+    filesystem supports it, or as hardlinks otherwise, so packages that ship
+    the same files share their disk space and only extract what the store
+    does not have yet. Stored files are made read-only, since writing to a
+    hardlinked file would change it for every package. On filesystems without
+    copy-on-write clones (ext4, NTFS, ...) installed files are therefore
+    read-only too; files a game rewrites, such as shipped configs or saves,
+    should be listed in the `writable` patterns of `install`, which gives
+    them a copy of their own.
+
+    An SQLite index records which hashes each install directory references;
+    `gc` removes the stored files no install references anymore.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self._objects_dir = os.path.join(self.root, "objects")
+        self._temp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._temp_dir, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(self.root, "store.db"))
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._db.close()
+
+    def object_path(self, file_hash):
+        """Path of the stored file with SHA-256 `file_hash`, whether or not it is stored."""
+        if len(file_hash) != 64 or not all(c in string.hexdigits for c in file_hash):
+            raise ValueError(f"Invalid file hash: {file_hash}")
+        file_hash = file_hash.lower()
+        return os.path.join(self._objects_dir, file_hash[:2], file_hash[2:])
+
+    def temp_path(self):
+        """Return a new temporary file on the store's filesystem, to be moved in with `add_object`."""
+        fd, path = tempfile.mkstemp(dir=self._temp_dir)
+        os.close(fd)
+        return path
+
+    def add_object(self, path, file_hash):
+        """Move a file whose hash has been checked into the store. If the store already has it, `path` is removed instead."""
+        object_path = self.object_path(file_hash)
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        if os.path.exists(object_path):
+            os.remove(path)
+            return
+        os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        try:
+            os.replace(path, object_path)
+        except OSError:
+            # Another thread stored the same content first; replacing a read-only file fails on Windows.
+            if not os.path.exists(object_path):
+                raise
+            _remove_read_only(path)
+
+    def install(self, uspkg_file, install_dir, workers=None, update_progress_callback=None, chunk_size=DEFAULT_CHUNK_SIZE, instrumentation=None, writable=()):
+        """
+        Install a .uspkg file into `install_dir` through the store.
+
+        Works like `install_uspkg`, except that files already in the store
+        are linked instead of being extracted, and extracted files are added
+        to the store. `uspkg_file` may also be an `_HttpSource`.
+
+        Args:
+        writable (iterable): Glob patterns of member names (e.g. "*.ini",
+            "saves/*") installed as writable copies instead of read-only
+            hardlinks. ["*"] never hardlinks.
+
+        Returns:
+        tuple: Number of files extracted and number of files taken from the store.
+        """
+        install_dir = os.path.abspath(install_dir)
+        with _open_package(uspkg_file) as package:
+            metadata = package.metadata
+        hashes = set(metadata["files"].values())
+
+        # Reference the new files before they are stored, so that a concurrent gc never removes them.
+        with self._db:
+            referenced = {row["hash"] for row in self._db.execute("SELECT hash FROM refs WHERE install_dir = ?", (install_dir,))}
+            self._set_refs(install_dir, hashes - referenced, ())
+        try:
+            counts = _install(uspkg_file, install_dir, workers, update_progress_callback, chunk_size, instrumentation, store=self, writable=tuple(writable))
+        except BaseException:
+            # install_dir was left as it was, and so are its references.
+            with self._db:
+                self._set_refs(install_dir, (), hashes - referenced)
+            raise
+
+        with self._db:
+            self._set_refs(install_dir, (), referenced - hashes)
+            self._db.execute(
+                "INSERT OR REPLACE INTO installs (install_dir, uid, title, installed_at) VALUES (?, ?, ?, ?)",
+                (install_dir, metadata.get("UID"), metadata.get("title"), time.time())
+            )
+        return counts
+
+    def uninstall(self, install_dir):
+        """Remove an install directory and drop its references. Run `gc` to free the files only it used."""
+        install_dir = os.path.abspath(install_dir)
+        if self._db.execute("SELECT 1 FROM installs WHERE install_dir = ?", (install_dir,)).fetchone() is None:
+            raise ValueError(f"Not installed through this store: {install_dir}")
+        if os.path.isdir(install_dir):
+            cleared = []
+
+            def remove_read_only(function, path, exc_info):
+                cleared.append(path)
+                os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+                function(path)
+
+            shutil.rmtree(install_dir, onerror=remove_read_only)
+            if cleared:
+                # On Windows the read-only flag belongs to the file, so clearing it on a hardlink cleared it on the stored object too.
+                for row in self._db.execute("SELECT hash FROM refs WHERE install_dir = ?", (install_dir,)):
+                    object_path = self.object_path(row["hash"])
+                    if os.path.exists(object_path):
+                        os.chmod(object_path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+        with self._db:
+            self._forget(install_dir)
+
+    def list(self):
+        """Return the installs made through the store, with the number of distinct files each references."""
+        return [dict(row) for row in self._db.execute(
+            "SELECT installs.*, COUNT(refs.hash) AS file_count FROM installs "
+            "LEFT JOIN refs ON refs.install_dir = installs.install_dir "
+            "GROUP BY installs.install_dir ORDER BY installs.install_dir"
+        )]
+
+    def gc(self):
+        """
+        Remove stored files that no install references anymore.
+
+        Installs whose directory was deleted by hand are forgotten first.
+
+        Returns:
+        tuple: Number of files removed and number of bytes freed.
+        """
+        with self._db:
+            for row in self._db.execute("SELECT install_dir FROM installs").fetchall():
+                if not os.path.isdir(row["install_dir"]):
+                    self._forget(row["install_dir"])
+            referenced = {row["hash"] for row in self._db.execute("SELECT DISTINCT hash FROM refs")}
+
+        removed = freed = 0
+        for prefix in os.listdir(self._objects_dir):
+            prefix_dir = os.path.join(self._objects_dir, prefix)
+            for name in os.listdir(prefix_dir):
+                if prefix + name in referenced:
+                    continue
+                path = os.path.join(prefix_dir, name)
+                freed += os.path.getsize(path)
+                _remove_read_only(path)
+                removed += 1
+            if not os.listdir(prefix_dir):
+                os.rmdir(prefix_dir)
+        return removed, freed
+
+    def _set_refs(self, install_dir, added, removed):
+        self._db.executemany("INSERT OR IGNORE INTO refs (install_dir, hash) VALUES (?, ?)", ((install_dir, h) for h in added))
+        self._db.executemany("DELETE FROM refs WHERE install_dir = ? AND hash = ?", ((install_dir, h) for h in removed))
+
+    def _forget(self, install_dir):
+        self._db.execute("DELETE FROM refs WHERE install_dir = ?", (install_dir,))
+        self._db.execute("DELETE FROM installs WHERE install_dir = ?", (install_dir,))
+
+def _remove_read_only(path):
+    # Stored objects are read-only, and Windows refuses to delete read-only files.
+    os.chmod(path, stat.S_IRUSR | stat.S_IWUSR)
+    os.remove(path)
@@ -2,101 +2,514 @@ import os
 import uuid
 import io
 import zipfile
-from ._encryption import _generate_key_from_uid, _encrypt_data, _decrypt_data
-from ._file_operations import _zip_folder
-from .metadata import write_uspkg, read_uspkg_metadata
-from ._utils import _encode_image_to_base64, _verify_file_in_zip, _calculate_sha256
+import fnmatch
+import time
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from ._encryption import _generate_key_from_uid, _EncryptingWriter, _HashingDecryptingReader, _SegmentEncryptingWriter, DEFAULT_SEGMENT_SIZE
+from ._install import _install, _member_relpath, _write_member
+from ._http import _HttpSource, HTTP_CONNECTIONS
+from ._file_operations import _zip_folder, _scan_folder, _hash_entries, _HashCache, _CompressionPolicy
+from .metadata import write_uspkg_trailer, read_uspkg_trailer, UspkgFile, FORMAT_VERSIONS, _replace_trailer, _recover_edit
+from .instrumentation import NULL_INSTRUMENTATION, _ByteProgress
+from ._utils import _read_image, _make_thumbnail, _verify_file_in_zip, _calculate_sha256, DEFAULT_CHUNK_SIZE, VERIFY_LEVELS
 
-def create_encrypted_uspkg_with_uid(folder_path, output_file, title, description, image_path, _type, main_exe, update_progress_callback=None):
+def create_encrypted_uspkg_with_uid(folder_path, output_file, title, description, image_path, _type, main_exe, update_progress_callback=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=1, hash_cache=None, compression="deflate", compresslevel=None, instrumentation=None, format_version=1):
+    """
+    Create an encrypted .uspkg file from the contents of a folder.
+
+    The archive is streamed through the encryptor straight into `output_file`,
+    so memory use is bounded by `chunk_size` regardless of the package size.
+    With `workers` > 1, files are hashed and compressed on that many threads.
+    If `hash_cache` is the path of a hash cache file, files whose size and
+    mtime match it are not hashed again, and it is updated with the hashes of
+    the packaged files for later builds.
+    `compression` is "stored", "deflate", "bzip2", "lzma" or "auto", which
+    stores already-compressed files and deflates the rest; `compresslevel`
+    is passed to the compressor.
+    `update_progress_callback` is called with the percentage of bytes packaged
+    so far. `instrumentation` receives a `StageEvent` for every block of work,
+    see `uspkg.instrumentation`.
+    `format_version` 1 (the default) writes the single AES-CFB stream that
+    every version of this library and existing launchers read. Version 2 is
+    opt-in: it splits the payload into AES-GCM segments that are sealed in
+    parallel and authenticate themselves, but older readers cannot open it.
+    If creation fails, the partially written output file is removed.
+    """
+    policy = _CompressionPolicy(compression, compresslevel)
+    metadata = _new_metadata(title, description, image_path, _type, main_exe)
+    cache = _HashCache(hash_cache) if hash_cache else None
+    _write_package(folder_path, output_file, metadata, update_progress_callback, chunk_size, workers, hash_cache=cache, policy=policy, instrumentation=instrumentation, format_version=format_version)
+    if cache is not None:
+        cache.save()
+
+def create_delta_uspkg(folder_path, output_file, base, title, description, image_path, _type, main_exe, update_progress_callback=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=1, hash_cache=None, compression="deflate", compresslevel=None, instrumentation=None, format_version=1):
+    """
+    Create a delta .uspkg holding only the files of `folder_path` that were
+    added or changed since `base`, plus the list of files that were deleted.
+
+    Args:
+    base (str or dict): Path to the previous .uspkg file, or its metadata["files"] map.
+    hash_cache (str): Optional path of a hash cache file. Files whose size and
+        mtime match the cache are not read again to find out whether they changed.
+
+    The other arguments are the same as for `create_encrypted_uspkg_with_uid`.
+    Use `apply_delta` to patch a tree installed from the base package.
+    """
+    policy = _CompressionPolicy(compression, compresslevel)
+    if isinstance(base, dict):
+        base_uid, base_files = None, base
+    else:
+        _, base_metadata = read_uspkg_trailer(base)
+        base_uid, base_files = base_metadata["UID"], base_metadata["files"]
+
+    metadata = _new_metadata(title, description, image_path, _type, main_exe)
+    cache = _HashCache(hash_cache) if hash_cache else None
+
+    entries = _scan_folder(folder_path)
+    hashes = _hash_entries(entries, cache, workers, instrumentation)
+    changed = [(file_path, arcname) for file_path, arcname in entries if base_files.get(arcname) != hashes[arcname]]
+    metadata["delta"] = {
+        "baseUID": base_uid,
+        "deleted": sorted(base_files.keys() - hashes.keys()),
+    }
+
+    _write_package(folder_path, output_file, metadata, update_progress_callback, chunk_size, workers, entries=changed, hash_cache=cache, policy=policy, instrumentation=instrumentation, format_version=format_version)
+    if cache is not None:
+        cache.save()
+
+def _new_metadata(title, description, image_path, _type, main_exe):
     if len(title) < 1 or len(title) > 100:
         raise ValueError("Title must contain 1-100 characters.")
-    
-    uid = str(uuid.uuid4())
-    key = _generate_key_from_uid(uid)
-    
-    # Encode image as base64
-    image_data = _encode_image_to_base64(image_path)
-    
-    metadata = {
-        "UID": uid,
+
+    # Store the image as raw bytes, with a small preview so readers do not have to decode the full image
+    image_data = _read_image(image_path)
+
+    return {
+        "UID": str(uuid.uuid4()),
         "title": title,
         "description": description,
         "image": image_data,
+        "thumbnail": _make_thumbnail(image_data),
         "type": _type,
         "mainExe": main_exe,
         "zipEncryptedHash": "",
         "zipHash": "",
         "files": {}
     }
-    
-    zip_file_path, zip_metadata = _zip_folder(folder_path, update_progress_callback)
-    metadata["files"] = zip_metadata["files"]
-    metadata["zipHash"] = zip_metadata["zipHash"]
-    
-    with open(zip_file_path, 'rb') as f_zip:
-        zip_data = f_zip.read()
-    
-    encrypted_zip_data, iv = _encrypt_data(key, zip_data)
 
-    metadata['zipEncryptedHash'] = _calculate_sha256(encrypted_zip_data)
-    
-    write_uspkg(output_file, encrypted_zip_data, iv, metadata)
-    os.remove(zip_file_path)
+# Editable metadata fields: keyword argument of `update_uspkg_metadata` -> metadata key
+EDITABLE_FIELDS = {
+    "title": "title",
+    "description": "description",
+    "type": "type",
+    "main_exe": "mainExe",
+}
+
+def update_uspkg_metadata(uspkg_file, **fields):
+    """
+    Change the metadata of a .uspkg file without rebuilding it.
+
+    Only the trailer is rewritten; the payload is left untouched, so the time
+    taken does not depend on the size of the package. The edit is crash-safe:
+    an interrupted edit leaves either the old or the new metadata.
 
-def verify_uspkg_file(uspkg_file, uid=None):
+    Args:
+    uspkg_file (str): Path to the .uspkg file.
+    title, description, type, main_exe (str): New values of those fields.
+    image (str): Path to a new cover image; its thumbnail is regenerated.
+
+    Returns:
+    dict: The new metadata.
+    """
+    unknown = fields.keys() - EDITABLE_FIELDS.keys() - {"image"}
+    if unknown:
+        raise ValueError(f"Metadata fields cannot be edited: {', '.join(sorted(unknown))}")
+    if "title" in fields and (len(fields["title"]) < 1 or len(fields["title"]) > 100):
+        raise ValueError("Title must contain 1-100 characters.")
+
+    _recover_edit(uspkg_file)
+    with UspkgFile(uspkg_file) as package:
+        payload_size, iv, metadata = package.payload_size, package.iv, dict(package.metadata)
+    metadata.pop("payloadSize", None)
+
+    for name, key in EDITABLE_FIELDS.items():
+        if name in fields:
+            metadata[key] = fields[name]
+    if "image" in fields:
+        image_data = _read_image(fields["image"])
+        metadata["image"] = image_data
+        metadata["thumbnail"] = _make_thumbnail(image_data)
+
+    _replace_trailer(uspkg_file, payload_size, iv, metadata)
+    return metadata
+
+def _write_package(folder_path, output_file, metadata, update_progress_callback=None, chunk_size=DEFAULT_CHUNK_SIZE, workers=1, entries=None, hash_cache=None, policy=None, instrumentation=None, format_version=1):
+    if format_version not in FORMAT_VERSIONS:
+        raise ValueError(f"Unsupported .uspkg format version: {format_version}")
+    key = _generate_key_from_uid(metadata["UID"])
     try:
-        encrypted_zip_data, iv, metadata = read_uspkg_metadata(uspkg_file)
-        title = metadata.get("title", "")
-        if len(title) < 1 or len(title) > 100:
-            return False
-        
-        encrypted_zip_hash = _calculate_sha256(io.BytesIO(encrypted_zip_data).read())
-        if encrypted_zip_hash != metadata.get('zipEncryptedHash', ''):
-            print("Encrypted ZIP hash does not match.")
-            return False
-
-        uid = uid or metadata["UID"]
-        key = _generate_key_from_uid(uid)
-        zip_data = _decrypt_data(key, iv, encrypted_zip_data)
-        
-        zip_hash = _calculate_sha256(io.BytesIO(zip_data).read())
-        if zip_hash != metadata.get('zipHash', ''):
-            print("ZIP hash does not match.")
-            return False
-
-        with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zip_file:
-            for file_name, stored_hash in metadata["files"].items():
-                if file_name not in zip_file.namelist():
-                    return False
-                if not _verify_file_in_zip(zip_file, file_name, stored_hash):
-                    return False
+        with open(output_file, 'wb') as f_out:
+            if format_version == 2:
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    writer = _SegmentEncryptingWriter(f_out, key, executor, workers, DEFAULT_SEGMENT_SIZE, instrumentation)
+                    zip_metadata = _zip_folder(folder_path, writer, update_progress_callback, workers, chunk_size, entries, hash_cache, policy, instrumentation)
+                    writer.close()
+
+                # Every segment carries its own tag, so there are no whole-payload hashes to store.
+                del metadata["zipHash"], metadata["zipEncryptedHash"]
+                metadata["formatVersion"] = 2
+                metadata["segments"] = {"size": writer.segment_size, "count": writer.segment_count, "plainSize": writer.tell()}
+            else:
+                writer = _EncryptingWriter(f_out, key, chunk_size, instrumentation)
+                zip_metadata = _zip_folder(folder_path, writer, update_progress_callback, workers, chunk_size, entries, hash_cache, policy, instrumentation)
+                writer.close()
+
+                metadata["zipHash"] = writer.plain_hash.hexdigest()
+                metadata['zipEncryptedHash'] = writer.encrypted_hash.hexdigest()
+
+            metadata["files"] = zip_metadata["files"]
+            write_uspkg_trailer(f_out, writer.iv, metadata)
+    except BaseException:
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        raise
+
+def verify_uspkg_file(uspkg_file, uid=None, level="full", chunk_size=DEFAULT_CHUNK_SIZE, update_progress_callback=None, instrumentation=None):
+    """
+    Verify the integrity of a .uspkg file.
+
+    Args:
+    uspkg_file (str): Path to the .uspkg file to verify.
+    uid (str): UID to derive the key from. Defaults to the UID in the metadata.
+    level (str): How deep to check:
+        "trailer" only checks that the metadata is well formed,
+        "container" also checks the encrypted and decrypted ZIP hashes,
+        or authenticates every segment of a version 2 package,
+        "full" also checks the hash of every file in the package.
+        The payload is read from disk at most once ("trailer" does not read it).
+    update_progress_callback (callable): Called with the percentage of the payload checked so far.
+    instrumentation (Instrumentation): Receives a `StageEvent` for every block of work.
+
+    Returns:
+    bool: True if the package is valid.
+    """
+    if level not in VERIFY_LEVELS:
+        raise ValueError(f"Unknown verification level: {level}")
+    try:
+        _verify_uspkg(uspkg_file, uid, level, chunk_size, update_progress_callback, instrumentation)
         return True
     except Exception as e:
         print(f"Error during verification: {e}")
         return False
 
-def extract_encrypted_uspkg_with_uid(uspkg_file, output_dir):
+def _check_trailer(metadata, uid=None):
+    title = metadata.get("title", "")
+    if len(title) < 1 or len(title) > 100:
+        raise ValueError("Title must contain 1-100 characters.")
+    if not (uid or metadata.get("UID")):
+        raise ValueError("Metadata has no UID.")
+    if not isinstance(metadata.get("files"), dict):
+        raise ValueError("Metadata has no file list.")
+
+def _verify_uspkg(uspkg_file, uid=None, level="full", chunk_size=DEFAULT_CHUNK_SIZE, update_progress_callback=None, instrumentation=None):
+    """Verify a .uspkg file, raising ValueError with the reason if it is invalid."""
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    with UspkgFile(uspkg_file) as package:
+        metadata = package.metadata
+        _check_trailer(metadata, uid)
+        if level == "trailer":
+            if update_progress_callback:
+                update_progress_callback(100)
+            return
+
+        if package.format_version == 2:
+            raw_payload = package.open_raw_decrypted(uid, update_progress_callback, instrumentation)
+        else:
+            key = _generate_key_from_uid(uid or metadata["UID"])
+            raw_payload = _HashingDecryptingReader(package.fileobj, key, package.iv, package.payload_size, package.payload_offset, update_progress_callback, instrumentation)
+
+        if level == "full":
+            files = metadata["files"]
+            with zipfile.ZipFile(io.BufferedReader(raw_payload, buffer_size=chunk_size), 'r') as zip_file:
+                missing = files.keys() - set(zip_file.namelist())
+                if missing:
+                    raise ValueError(f"File missing from package: {min(missing)}")
+                # Walk members in archive order so the payload is hashed as it is read.
+                for zinfo in sorted(zip_file.infolist(), key=lambda zinfo: zinfo.header_offset):
+                    expected_hash = files.get(zinfo.filename)
+                    if expected_hash is not None and not _verify_file_in_zip(zip_file, zinfo, expected_hash, instrumentation):
+                        raise ValueError(f"File hash does not match: {zinfo.filename}")
+
+        if package.format_version == 2:
+            # Segments the member walk did not cover are authenticated in parallel.
+            workers = os.cpu_count() or 1
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                raw_payload.finish(executor, workers)
+            return
+
+        encrypted_zip_hash, zip_hash = raw_payload.finish(chunk_size)
+        if encrypted_zip_hash != metadata.get('zipEncryptedHash', ''):
+            raise ValueError("Encrypted ZIP hash does not match.")
+        if zip_hash != metadata.get('zipHash', ''):
+            raise ValueError("ZIP hash does not match.")
+
+def verify_directory(directory, jobs=None, level="full"):
+    """
+    Verify every .uspkg file under `directory` on a pool of processes.
+
+    The largest packages are scheduled first so that a few huge files do not
+    end up running alone at the end. Results are yielded as soon as each
+    package is done, as dicts with the keys "path", "ok", "reason" (None when
+    valid), "bytes" and "seconds".
+
+    Args:
+    directory (str): Directory to scan recursively, or a single .uspkg file.
+        Raises FileNotFoundError or NotADirectoryError if it is neither.
+    jobs (int): Number of worker processes. Defaults to the number of CPUs.
+    level (str): Verification level, see `verify_uspkg_file`.
+    """
+    return verify_packages(_find_packages(directory), jobs, level)
+
+def verify_packages(paths, jobs=None, level="full"):
+    """Verify a list of .uspkg files on a pool of processes. See `verify_directory`."""
+    if level not in VERIFY_LEVELS:
+        raise ValueError(f"Unknown verification level: {level}")
+    packages = sorted(paths, key=os.path.getsize, reverse=True)
+    if not packages:
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_verify_for_batch, path, level) for path in packages]
+        for future in as_completed(futures):
+            yield future.result()
+
+def _find_packages(directory):
+    if os.path.isfile(directory):
+        return [directory]
+    # os.walk silently yields nothing for a missing path; a wrong path must not look like a clean run.
+    if not os.path.exists(directory):
+        raise FileNotFoundError(f"No such directory: {directory}")
+    if not os.path.isdir(directory):
+        raise NotADirectoryError(f"Not a directory: {directory}")
+    packages = []
+    for root, _, files in os.walk(directory):
+        packages.extend(os.path.join(root, file) for file in files if file.endswith(".uspkg"))
+    return packages
+
+def _verify_for_batch(uspkg_file, level):
+    start = time.perf_counter()
+    try:
+        _verify_uspkg(uspkg_file, level=level)
+        reason = None
+    except Exception as e:
+        reason = str(e) or type(e).__name__
+    return {
+        "path": uspkg_file,
+        "ok": reason is None,
+        "reason": reason,
+        "bytes": os.path.getsize(uspkg_file),
+        "seconds": round(time.perf_counter() - start, 6),
+    }
+
+def extract_encrypted_uspkg_with_uid(uspkg_file, output_dir, instrumentation=None, update_progress_callback=None):
     """
     Extract the contents of an encrypted .uspkg file.
     
     Args:
     uspkg_file (str): Path to the .uspkg file to be extracted.
     output_dir (str): Directory where the extracted files will be saved.
+    instrumentation (Instrumentation): Receives a `StageEvent` for every block of work.
+    update_progress_callback (callable): Called with the percentage of bytes extracted so far.
     """
     try:
-        # Read metadata and encrypted content
-        encrypted_zip_data, iv, metadata = read_uspkg_metadata(uspkg_file)
-        
-        # Generate the key from the UID
-        key = _generate_key_from_uid(metadata["UID"])
-        
-        # Decrypt the ZIP data
-        zip_data = _decrypt_data(key, iv, encrypted_zip_data)
-        
-        # Extract the ZIP file into the output directory
-        with zipfile.ZipFile(io.BytesIO(zip_data), 'r') as zip_ref:
-            zip_ref.extractall(output_dir)
-        
+        _extract(uspkg_file, output_dir, update_progress_callback, instrumentation)
         print(f"Extraction complete. Files saved to {output_dir}")
     except Exception as e:
-        print(f"Error during extraction: {e}")
\ No newline at end of file
+        print(f"Error during extraction: {e}")
+
+def _extract(uspkg_file, output_dir, update_progress_callback=None, instrumentation=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Extract a .uspkg file, raising on failure.
+
+    Members are streamed in blocks of `chunk_size` and checked against
+    metadata["files"], and progress is reported per block, so it keeps moving
+    inside large files and an exception raised from `update_progress_callback`
+    stops the extraction mid-file. Each file is written under a temporary name
+    and renamed once complete. If the extraction fails or is stopped, the files
+    and directories it created are removed again; existing files it already
+    replaced keep their new content.
+    """
+    instrumentation = instrumentation or NULL_INSTRUMENTATION
+    created = []
+    try:
+        # Decrypt the payload as it is read instead of loading it into memory
+        with UspkgFile(uspkg_file) as package, package.open_zip(chunk_size, instrumentation) as zip_ref:
+            files = package.metadata.get("files", {})
+            members = zip_ref.infolist()
+            progress = _ByteProgress(sum(zinfo.file_size for zinfo in members), update_progress_callback)
+            for zinfo in members:
+                path = os.path.join(output_dir, _member_relpath(zinfo.filename))
+                if zinfo.is_dir():
+                    _make_dirs(path, created)
+                    continue
+                _make_dirs(os.path.dirname(path), created)
+                existed = os.path.lexists(path)
+                temp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.uspkg-part")
+                try:
+                    _write_member(zip_ref, zinfo, temp_path, files.get(zinfo.filename), chunk_size, instrumentation, progress)
+                    os.replace(temp_path, path)
+                except BaseException:
+                    if os.path.exists(temp_path):
+                        os.remove(temp_path)
+                    raise
+                if not existed:
+                    created.append(path)
+            if not members:
+                progress.advance(0)
+    except BaseException:
+        _remove_created(created)
+        raise
+
+def _make_dirs(directory, created):
+    """Create `directory` and its missing parents, appending the ones created to `created`, outermost first."""
+    missing = []
+    while directory and not os.path.isdir(directory):
+        missing.append(directory)
+        directory = os.path.dirname(directory)
+    for directory in reversed(missing):
+        os.makedirs(directory, exist_ok=True)
+        created.append(directory)
+
+def _remove_created(created):
+    # Innermost first, so that directories are empty by the time they are removed.
+    for path in reversed(created):
+        try:
+            if os.path.isdir(path):
+                os.rmdir(path)
+            else:
+                os.remove(path)
+        except OSError:
+            pass
+
+def install_uspkg(uspkg_file, install_dir, workers=None, update_progress_callback=None, chunk_size=DEFAULT_CHUNK_SIZE, instrumentation=None):
+    """
+    Install the contents of an encrypted .uspkg file into `install_dir`.
+
+    Unlike `extract_encrypted_uspkg_with_uid`, files are decompressed by a pool
+    of `workers` threads and checked against metadata["files"] as they are
+    written, files that are already installed with the right hash are kept,
+    and the result is assembled in a staging directory that replaces
+    `install_dir` only once everything succeeded. Files in `install_dir` that
+    are not part of the package are removed. Progress is reported as the
+    percentage of bytes installed.
+
+    Returns:
+    tuple: Number of files extracted and number of files reused.
+    """
+    return _install(uspkg_file, install_dir, workers, update_progress_callback, chunk_size, instrumentation)
+
+def install_uspkg_from_url(url, install_dir, workers=None, update_progress_callback=None, chunk_size=DEFAULT_CHUNK_SIZE, instrumentation=None, connections=HTTP_CONNECTIONS):
+    """
+    Install a .uspkg package served over HTTP without saving it first.
+
+    The trailer and ZIP directory are fetched with a range request, then the
+    payload is downloaded in blocks over `connections` keep-alive connections
+    while it is decrypted, extracted and checked, so installing takes about
+    as long as downloading. Otherwise it works like `install_uspkg`. The
+    server must support HTTP range requests.
+
+    Returns:
+    tuple: Number of files extracted and number of files reused.
+    """
+    with _HttpSource(url, connections, chunk_size=chunk_size) as source:
+        return _install(source, install_dir, workers, update_progress_callback, chunk_size, instrumentation)
+
+@contextmanager
+def _open_payload_zip(uspkg_file, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Open the payload of a .uspkg file as a `zipfile.ZipFile`, decrypting only what is read."""
+    with UspkgFile(uspkg_file) as package, package.open_zip(chunk_size) as zip_file:
+        yield zip_file, package.metadata
+
+def _extract_verified_member(zip_file, name, dest, expected_hash):
+    extracted_path = zip_file.extract(name, dest)
+    if expected_hash is not None and _calculate_sha256(extracted_path) != expected_hash:
+        os.remove(extracted_path)
+        raise ValueError(f"Hash mismatch for {name}.")
+    return extracted_path
+
+def extract_member(uspkg_file, name, dest):
+    """
+    Extract a single file from an encrypted .uspkg file.
+
+    Only the ZIP directory and the requested member are read and decrypted, so
+    the cost does not depend on the size of the rest of the package.
+
+    Args:
+    uspkg_file (str): Path to the .uspkg file.
+    name (str): Name of the member inside the package.
+    dest (str): Directory where the file will be saved.
+
+    Returns:
+    str: Path of the extracted file.
+    """
+    with _open_payload_zip(uspkg_file) as (zip_file, metadata):
+        return _extract_verified_member(zip_file, name, dest, metadata["files"].get(name))
+
+def extract_matching(uspkg_file, pattern, dest):
+    """
+    Extract every member whose name matches a shell-style `pattern`.
+
+    Returns:
+    list: Paths of the extracted files.
+    """
+    with _open_payload_zip(uspkg_file) as (zip_file, metadata):
+        return [
+            _extract_verified_member(zip_file, name, dest, metadata["files"].get(name))
+            for name in zip_file.namelist()
+            if fnmatch.fnmatch(name, pattern)
+        ]
+
+def apply_delta(delta_file, target_dir):
+    """
+    Patch a tree installed from the base package of `delta_file` in place.
+
+    Every file in the delta is extracted and checked against its hash before
+    it replaces the installed copy, then the files listed as deleted are
+    removed. Files that are not part of the delta are left untouched.
+
+    Returns:
+    tuple: Lists of the updated and deleted paths.
+    """
+    target_dir = os.path.abspath(target_dir)
+    updated = []
+    with _open_payload_zip(delta_file) as (zip_file, metadata):
+        delta = metadata.get("delta")
+        if delta is None:
+            raise ValueError("Not a delta package.")
+        with tempfile.TemporaryDirectory(prefix=".uspkg-delta-", dir=target_dir) as staging_dir:
+            for name in zip_file.namelist():
+                staged_path = _extract_verified_member(zip_file, name, staging_dir, metadata["files"].get(name))
+                target_path = os.path.join(target_dir, os.path.relpath(staged_path, staging_dir))
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                os.replace(staged_path, target_path)
+                updated.append(target_path)
+
+    deleted = []
+    for name in delta["deleted"]:
+        target_path = os.path.abspath(os.path.join(target_dir, name))
+        if os.path.commonpath([target_dir, target_path]) != target_dir:
+            raise ValueError(f"Refusing to delete outside of the target directory: {name}")
+        if os.path.isfile(target_path):
+            os.remove(target_path)
+            deleted.append(target_path)
+            _remove_empty_parents(os.path.dirname(target_path), target_dir)
+    return updated, deleted
+
+def _remove_empty_parents(directory, stop_dir):
+    while directory != stop_dir and os.path.commonpath([stop_dir, directory]) == stop_dir:
+        try:
+            os.rmdir(directory)
+        except OSError:
+            return
+        directory = os.path.dirname(directory)
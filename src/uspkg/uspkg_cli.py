@@ -1,18 +1,33 @@
 import argparse
-import base64
-from PIL import Image
+import json
+import sys
+import time
 import uspkg
 import shutil
 import io
-from colorama import init, Fore
-from term_image.image import AutoImage
 
-# Initialize colorama for cross-platform support
-init(autoreset=True)
+# Pillow, term_image and colorama are only imported by the commands that use
+# them, so that scripted calls such as `info` start quickly.
+
+class _LazyFore:
+    """Stands in for colorama's Fore until a color is first used, then imports and initializes colorama."""
+
+    def __getattr__(self, name):
+        global Fore
+        from colorama import init, Fore as colorama_fore
+
+        # Initialize colorama for cross-platform support
+        init(autoreset=True)
+        Fore = colorama_fore
+        return getattr(Fore, name)
+
+Fore = _LazyFore()
 
 def display_image_in_terminal(image_data, left_column_width):
     """Display the image in the terminal using term_image."""
     try:
+        from term_image.image import AutoImage
+
         # Use term_image to display the image in the terminal
         img = AutoImage(image_data)
         wid, hgt = image_data.size
@@ -23,16 +38,31 @@ def display_image_in_terminal(image_data, left_column_width):
         print(Fore.RED + f"Failed to display image: {e}")
 
 
-def create_uspkg(folder, output_file, title, description, image_file):
-    """Create a .uspkg package."""
+def create_uspkg(folder, output_file, title, description, image_file, _type="", main_exe="", workers=1, base=None, hash_cache=None, compression="deflate", compresslevel=None, instrumentation=None, format_version=1):
+    """Create a .uspkg package, or a delta package against `base`."""
+    last_percent = [-1]
+
     def update_progress(percent):
-        print(Fore.CYAN + f"Progress: {percent:.2f}%")
+        # Progress is reported per block; only print when the whole percentage changes.
+        if int(percent) != last_percent[0]:
+            last_percent[0] = int(percent)
+            print(Fore.CYAN + f"Progress: {percent:.2f}%")
 
     try:
-        uspkg.create_encrypted_uspkg_with_uid(
-            folder, output_file, title, description, image_file,
-            update_progress_callback=update_progress
-        )
+        if base:
+            uspkg.create_delta_uspkg(
+                folder, output_file, base, title, description, image_file, _type, main_exe,
+                update_progress_callback=update_progress, workers=workers, hash_cache=hash_cache,
+                compression=compression, compresslevel=compresslevel, instrumentation=instrumentation,
+                format_version=format_version
+            )
+        else:
+            uspkg.create_encrypted_uspkg_with_uid(
+                folder, output_file, title, description, image_file, _type, main_exe,
+                update_progress_callback=update_progress, workers=workers, hash_cache=hash_cache,
+                compression=compression, compresslevel=compresslevel, instrumentation=instrumentation,
+                format_version=format_version
+            )
         print(Fore.GREEN + f"USPkg file created: {output_file}")
     except ValueError as e:
         print(Fore.RED + f"Failed to create package: {e}")
@@ -40,19 +70,80 @@ def create_uspkg(folder, output_file, title, description, image_file):
         print(Fore.RED + f"An unexpected error occurred: {e}")
 
 
-def extract_uspkg(uspkg_file, output_dir):
-    """Extract a .uspkg package."""
+def extract_uspkg(uspkg_file, output_dir, only=None, instrumentation=None):
+    """Extract a .uspkg package, or only the members matching `only`."""
     try:
-        uspkg.extract_encrypted_uspkg_with_uid(uspkg_file, output_dir)
+        if only:
+            extracted = uspkg.extract_matching(uspkg_file, only, output_dir)
+            if not extracted:
+                print(Fore.YELLOW + f"No files match: {only}")
+                return
+            for path in extracted:
+                print(Fore.CYAN + f"Extracted: {path}")
+        else:
+            uspkg.extract_encrypted_uspkg_with_uid(uspkg_file, output_dir, instrumentation)
         print(Fore.GREEN + f"Files extracted to: {output_dir}")
     except Exception as e:
         print(Fore.RED + f"Failed to extract package: {e}")
 
-def preview_uspkg(uspkg_file):
+def install_uspkg(uspkg_file, install_dir, workers=None, instrumentation=None, store=None, connections=None, writable=()):
+    """
+    Install a .uspkg package, reusing files that are already installed or, with `store`, already stored.
+
+    `uspkg_file` may be an http(s) URL, in which case the package is installed while it downloads.
+    """
+    from uspkg._http import _HttpSource, is_url, HTTP_CONNECTIONS
+
+    try:
+        if store:
+            with uspkg.Store(store) as package_store:
+                if is_url(uspkg_file):
+                    with _HttpSource(uspkg_file, connections or HTTP_CONNECTIONS) as source:
+                        extracted, reused = package_store.install(source, install_dir, workers=workers, instrumentation=instrumentation, writable=writable)
+                else:
+                    extracted, reused = package_store.install(uspkg_file, install_dir, workers=workers, instrumentation=instrumentation, writable=writable)
+            print(Fore.GREEN + f"Installed to {install_dir}: {extracted} extracted, {reused} taken from the store")
+            return
+        if is_url(uspkg_file):
+            extracted, reused = uspkg.install_uspkg_from_url(uspkg_file, install_dir, workers=workers, instrumentation=instrumentation, connections=connections or HTTP_CONNECTIONS)
+        else:
+            extracted, reused = uspkg.install_uspkg(uspkg_file, install_dir, workers=workers, instrumentation=instrumentation)
+        print(Fore.GREEN + f"Installed to {install_dir}: {extracted} extracted, {reused} already up to date")
+    except Exception as e:
+        print(Fore.RED + f"Failed to install package: {e}")
+
+def uninstall_uspkg(install_dir, store):
+    """Uninstall a package installed through a store and free the files no other install uses."""
+    try:
+        with uspkg.Store(store) as package_store:
+            package_store.uninstall(install_dir)
+            removed, freed = package_store.gc()
+        print(Fore.GREEN + f"Uninstalled {install_dir}: {removed} stored files removed, {freed / (1024 * 1024):.1f} MB freed")
+    except Exception as e:
+        print(Fore.RED + f"Failed to uninstall package: {e}")
+
+def gc_store(store):
+    """Remove the stored files that no install references anymore."""
+    try:
+        with uspkg.Store(store) as package_store:
+            removed, freed = package_store.gc()
+        print(Fore.GREEN + f"{removed} stored files removed, {freed / (1024 * 1024):.1f} MB freed")
+    except Exception as e:
+        print(Fore.RED + f"Failed to clean up the store: {e}")
+
+def apply_delta(delta_file, target_dir):
+    """Apply a delta package to an installed tree."""
+    try:
+        updated, deleted = uspkg.apply_delta(delta_file, target_dir)
+        print(Fore.GREEN + f"Delta applied to {target_dir}: {len(updated)} updated, {len(deleted)} deleted")
+    except Exception as e:
+        print(Fore.RED + f"Failed to apply delta: {e}")
+
+def preview_uspkg(uspkg_file, instrumentation=None):
     """Preview and verify a .uspkg package."""
     try:
         # Verify the package
-        is_valid = uspkg.verify_uspkg_file(uspkg_file)
+        is_valid = uspkg.verify_uspkg_file(uspkg_file, instrumentation=instrumentation)
         if is_valid:
             print(Fore.GREEN + "Verification Status: Package is valid")
         else:
@@ -60,7 +151,7 @@ def preview_uspkg(uspkg_file):
             return
 
         # Read metadata
-        _, _, metadata = uspkg.read_uspkg_metadata(uspkg_file)
+        _, metadata = uspkg.read_uspkg_trailer(uspkg_file)
 
         # Prepare metadata information
         title = f"Package Title: {metadata.get('title', 'N/A')}"
@@ -75,8 +166,10 @@ def preview_uspkg(uspkg_file):
         print(f"{Fore.CYAN}{description.ljust(left_column_width)}", end='\n')
 
         # Display image on the right, aligned with the above text
-        if metadata.get("image"):
-            image_data = base64.b64decode(metadata["image"])
+        image_data = uspkg.get_image_data(metadata)
+        if image_data:
+            from PIL import Image
+
             image = Image.open(io.BytesIO(image_data))
             # Display the image using term_image
             display_image_in_terminal(image, left_column_width)
@@ -86,36 +179,186 @@ def preview_uspkg(uspkg_file):
     except Exception as e:
         print(Fore.RED + f"Failed to preview package: {e}")
 
+def verify_directory(directory, jobs=None, level="full"):
+    """
+    Verify every package under a directory, printing one JSON line per package and a summary.
+
+    Returns True only if packages were found and all of them are valid.
+    """
+    start = time.perf_counter()
+    total = valid = total_bytes = 0
+    try:
+        results = uspkg.verify_directory(directory, jobs=jobs, level=level)
+    except OSError as e:
+        print(f"Failed to verify packages: {e}", file=sys.stderr)
+        return False
+    for result in results:
+        print(json.dumps(result), flush=True)
+        total += 1
+        valid += result["ok"]
+        total_bytes += result["bytes"]
+    elapsed = time.perf_counter() - start
+    print(json.dumps({
+        "summary": {
+            "packages": total,
+            "ok": valid,
+            "failed": total - valid,
+            "bytes": total_bytes,
+            "seconds": round(elapsed, 3),
+            "mb_per_second": round(total_bytes / (1024 * 1024) / elapsed, 2) if elapsed else None,
+        }
+    }), flush=True)
+    if not total:
+        print(f"No .uspkg files found under {directory}", file=sys.stderr)
+    return total > 0 and total == valid
+
+def edit_uspkg(uspkg_file, fields):
+    """Change the metadata of a package in place."""
+    fields = {name: value for name, value in fields.items() if value is not None}
+    if not fields:
+        print(Fore.YELLOW + "Nothing to change.")
+        return
+    try:
+        uspkg.update_uspkg_metadata(uspkg_file, **fields)
+        print(Fore.GREEN + f"Updated {', '.join(sorted(fields))} of {uspkg_file}")
+    except Exception as e:
+        print(Fore.RED + f"Failed to edit package: {e}")
+
+def info_uspkg(uspkg_file, as_json=False):
+    """Print the metadata of a package, without its image. Only the trailer is read."""
+    try:
+        metadata = uspkg.read_uspkg_trailer(uspkg_file)[1]
+    except Exception as e:
+        print(f"Failed to read package: {e}", file=sys.stderr)
+        return False
+    info = {key: value for key, value in metadata.items() if key not in ("image", "thumbnail")}
+    if as_json:
+        print(json.dumps(info, default=_json_default))
+        return True
+    for key, value in info.items():
+        if key == "files":
+            print(f"files: {len(value)}")
+        elif isinstance(value, dict):
+            print(f"{key}: {json.dumps(value, default=_json_default)}")
+        else:
+            print(f"{key}: {value}")
+    return True
+
+def _json_default(value):
+    if isinstance(value, bytes):
+        return value.hex()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def print_profile(collector, json_file=None):
+    """Print the per-stage breakdown of an operation and optionally save it as JSON."""
+    print(Fore.CYAN + collector.report())
+    if json_file:
+        collector.to_json(json_file)
+        print(Fore.CYAN + f"Profile saved to: {json_file}")
+
 def main():
     parser = argparse.ArgumentParser(description="USPkg Tool CLI for creating, extracting, and previewing .uspkg files.")
     subparsers = parser.add_subparsers(dest="command", help="Commands")
 
+    # Options shared by the commands that can be profiled
+    profile_parser = argparse.ArgumentParser(add_help=False)
+    profile_parser.add_argument("--profile", action="store_true", help="Print the time and throughput of each stage")
+    profile_parser.add_argument("--profile-json", metavar="FILE", help="Save the stage timings as JSON to this file")
+
     # Create subcommand
-    create_parser = subparsers.add_parser("create", help="Create a new .uspkg package")
+    create_parser = subparsers.add_parser("create", parents=[profile_parser], help="Create a new .uspkg package")
     create_parser.add_argument("folder", help="Path to the folder to package")
     create_parser.add_argument("output", help="Output path for the .uspkg file")
     create_parser.add_argument("title", help="Title of the package")
     create_parser.add_argument("description", help="Description of the package")
     create_parser.add_argument("image", help="Path to the image file (png, jpg)")
-    create_parser.set_defaults(func=lambda args: create_uspkg(args.folder, args.output, args.title, args.description, args.image))
+    create_parser.add_argument("--type", default="", help="Type of the package (e.g. 'Roms Hack', 'Fan Game')")
+    create_parser.add_argument("--main-exe", default="", help="Main executable of the package")
+    create_parser.add_argument("--workers", type=int, default=1, help="Number of threads used to hash and compress files")
+    create_parser.add_argument("--base", metavar="USPKG", help="Previous package; create a delta holding only added and changed files")
+    create_parser.add_argument("--hash-cache", metavar="FILE", help="File caching hashes between builds")
+    create_parser.add_argument("--compression", choices=["auto", "stored", "deflate", "bzip2", "lzma"], default="deflate", help="Compression method; 'auto' stores files that do not compress")
+    create_parser.add_argument("--level", type=int, default=None, help="Compression level")
+    create_parser.add_argument("--format-version", type=int, choices=[1, 2], default=1, help="Container format; 2 uses authenticated AES-GCM segments but cannot be read by older versions of uspkg")
+    create_parser.set_defaults(func=lambda args: create_uspkg(args.folder, args.output, args.title, args.description, args.image, args.type, args.main_exe, args.workers, args.base, args.hash_cache, args.compression, args.level, args.instrumentation, args.format_version))
 
     # Extract subcommand
-    extract_parser = subparsers.add_parser("extract", help="Extract a .uspkg package")
+    extract_parser = subparsers.add_parser("extract", parents=[profile_parser], help="Extract a .uspkg package")
     extract_parser.add_argument("uspkg_file", help="Path to the .uspkg file")
     extract_parser.add_argument("output_dir", help="Directory where the package will be extracted")
-    extract_parser.set_defaults(func=lambda args: extract_uspkg(args.uspkg_file, args.output_dir))
+    extract_parser.add_argument("--only", metavar="PATTERN", help="Extract only the files matching this pattern (e.g. '*.exe')")
+    extract_parser.set_defaults(func=lambda args: extract_uspkg(args.uspkg_file, args.output_dir, args.only, args.instrumentation))
+
+    # Install subcommand
+    install_parser = subparsers.add_parser("install", parents=[profile_parser], help="Install a .uspkg package, verifying files and skipping unchanged ones")
+    install_parser.add_argument("uspkg_file", help="Path or http(s) URL of the .uspkg file")
+    install_parser.add_argument("install_dir", help="Directory where the package will be installed")
+    install_parser.add_argument("--workers", type=int, default=None, help="Number of threads used to extract files")
+    install_parser.add_argument("--store", metavar="DIR", help="Shared store; files already stored are linked instead of extracted. Hardlinked files are read-only, see --writable")
+    install_parser.add_argument("--connections", type=int, default=None, help="Number of HTTP connections used to download a package from a URL")
+    install_parser.add_argument("--writable", metavar="PATTERN", action="append", default=[], help="With --store, install files matching this glob (e.g. '*.ini') as writable copies instead of read-only links; repeatable")
+    install_parser.set_defaults(func=lambda args: install_uspkg(args.uspkg_file, args.install_dir, args.workers, args.instrumentation, args.store, args.connections, args.writable))
+
+    # Uninstall subcommand
+    uninstall_parser = subparsers.add_parser("uninstall", help="Uninstall a package installed through a store")
+    uninstall_parser.add_argument("install_dir", help="Directory the package was installed to")
+    uninstall_parser.add_argument("--store", metavar="DIR", required=True, help="Store the package was installed through")
+    uninstall_parser.set_defaults(func=lambda args: uninstall_uspkg(args.install_dir, args.store))
+
+    # Gc subcommand
+    gc_parser = subparsers.add_parser("gc", help="Remove stored files that no install uses anymore")
+    gc_parser.add_argument("store", help="Store directory")
+    gc_parser.set_defaults(func=lambda args: gc_store(args.store))
+
+    # Apply-delta subcommand
+    apply_delta_parser = subparsers.add_parser("apply-delta", help="Patch an installed tree with a delta package")
+    apply_delta_parser.add_argument("uspkg_file", help="Path to the delta .uspkg file")
+    apply_delta_parser.add_argument("target_dir", help="Directory installed from the base package")
+    apply_delta_parser.set_defaults(func=lambda args: apply_delta(args.uspkg_file, args.target_dir))
 
     # Preview subcommand
-    preview_parser = subparsers.add_parser("preview", help="Preview and verify a .uspkg package")
+    preview_parser = subparsers.add_parser("preview", parents=[profile_parser], help="Preview and verify a .uspkg package")
     preview_parser.add_argument("uspkg_file", help="Path to the .uspkg file")
-    preview_parser.set_defaults(func=lambda args: preview_uspkg(args.uspkg_file))
+    preview_parser.set_defaults(func=lambda args: preview_uspkg(args.uspkg_file, args.instrumentation))
+
+    # Edit subcommand
+    edit_parser = subparsers.add_parser("edit", help="Change the metadata of a .uspkg package without rebuilding it")
+    edit_parser.add_argument("uspkg_file", help="Path to the .uspkg file")
+    edit_parser.add_argument("--title", help="New title")
+    edit_parser.add_argument("--description", help="New description")
+    edit_parser.add_argument("--type", help="New package type")
+    edit_parser.add_argument("--main-exe", help="New main executable")
+    edit_parser.add_argument("--image", help="Path to a new image file (png, jpg)")
+    edit_parser.set_defaults(func=lambda args: edit_uspkg(args.uspkg_file, {
+        "title": args.title, "description": args.description, "type": args.type,
+        "main_exe": args.main_exe, "image": args.image,
+    }))
+
+    # Info subcommand
+    info_parser = subparsers.add_parser("info", help="Print the metadata of a .uspkg package without reading its payload")
+    info_parser.add_argument("uspkg_file", help="Path to the .uspkg file")
+    info_parser.add_argument("--json", action="store_true", help="Print the metadata as a single JSON object")
+    info_parser.set_defaults(func=lambda args: sys.exit(0 if info_uspkg(args.uspkg_file, args.json) else 1))
+
+    # Verify subcommand
+    verify_parser = subparsers.add_parser("verify", help="Verify every .uspkg package in a directory")
+    verify_parser.add_argument("directory", help="Directory containing .uspkg files")
+    verify_parser.add_argument("--jobs", "-j", type=int, default=None, help="Number of worker processes (default: number of CPUs)")
+    verify_parser.add_argument("--level", choices=uspkg.VERIFY_LEVELS, default="full", help="Verification level")
+    verify_parser.set_defaults(func=lambda args: sys.exit(0 if verify_directory(args.directory, args.jobs, args.level) else 1))
 
     # Parse arguments
     args = parser.parse_args()
 
     # Call the appropriate function based on the command
     if args.command:
+        profile = getattr(args, "profile", False) or getattr(args, "profile_json", None)
+        if profile:
+            from uspkg.instrumentation import StageCollector
+        args.instrumentation = StageCollector() if profile else None
         args.func(args)
+        if profile:
+            print_profile(args.instrumentation, args.profile_json)
     else:
         parser.print_help()
 
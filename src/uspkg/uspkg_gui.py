@@ -1,11 +1,104 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog, Label
 from tkinter import ttk
-import base64
 from PIL import Image, ImageTk
 import io
+import os
+import queue
+import threading
 import uspkg
-from threading import Thread
+from uspkg import uspkg as _uspkg
+
+PROGRESS_FPS = 30
+
+class _JobCancelled(Exception):
+    """Raised from a job's progress callback once the job has been cancelled."""
+
+class Job:
+    """
+    An operation running on its own worker thread.
+
+    The worker only ever writes `percent`; the UI reads it once per frame, so
+    any number of progress reports costs one redraw per frame at most.
+    """
+
+    def __init__(self, name, func, on_done=None):
+        self.name = name
+        self.percent = 0.0
+        self.status = "Running"
+        self.result = None
+        self.error = None
+        self._func = func
+        self._on_done = on_done
+        self._cancelled = threading.Event()
+
+    @property
+    def running(self):
+        return self.status == "Running"
+
+    def cancel(self):
+        """Ask the job to stop at its next progress report."""
+        self._cancelled.set()
+
+    def update_progress(self, percent):
+        if self._cancelled.is_set():
+            raise _JobCancelled()
+        self.percent = percent
+
+class JobRunner:
+    """
+    Runs jobs on worker threads and hands their outcome back to the Tk main thread.
+
+    Workers put finished jobs on a queue that is polled with `root.after`
+    `fps` times per second; `on_frame` is called after every poll to redraw
+    progress. Completion callbacks therefore always run on the main thread.
+    """
+
+    def __init__(self, root, on_frame=None, fps=PROGRESS_FPS):
+        self.root = root
+        self.jobs = []
+        self._on_frame = on_frame
+        self._interval = max(1, int(1000 / fps))
+        self._finished = queue.Queue()
+        self.root.after(self._interval, self._poll)
+
+    def submit(self, name, func, on_done=None):
+        """
+        Run `func(update_progress_callback)` on a worker thread.
+
+        `on_done(job)` is called on the main thread once it has finished,
+        failed or been cancelled.
+        """
+        job = Job(name, func, on_done)
+        self.jobs.append(job)
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return job
+
+    def _run(self, job):
+        try:
+            job.result = job._func(job.update_progress)
+            status = "Done"
+        except _JobCancelled:
+            status = "Cancelled"
+        except Exception as e:
+            job.error = str(e) or type(e).__name__
+            status = "Failed"
+        self._finished.put((job, status))
+
+    def _poll(self):
+        while True:
+            try:
+                job, status = self._finished.get_nowait()
+            except queue.Empty:
+                break
+            job.status = status
+            if status == "Done":
+                job.percent = 100.0
+            if job._on_done:
+                job._on_done(job)
+        if self._on_frame:
+            self._on_frame()
+        self.root.after(self._interval, self._poll)
 
 class UspkgApp:
     def __init__(self, root):
@@ -26,7 +119,19 @@ class UspkgApp:
         self.preview_button = ttk.Button(button_frame, text="Preview & Verify .uspkg", command=self.preview_uspkg)
         self.preview_button.grid(row=0, column=2, padx=5, pady=5)
 
-        # Progress bar
+        # Job list
+        self.job_list = ttk.Treeview(root, columns=("progress", "status"), height=5)
+        self.job_list.heading("#0", text="Job")
+        self.job_list.heading("progress", text="Progress")
+        self.job_list.heading("status", text="Status")
+        self.job_list.column("progress", width=80, anchor="e")
+        self.job_list.column("status", width=90)
+        self.job_list.pack(fill="x", padx=10)
+
+        self.cancel_button = ttk.Button(root, text="Cancel", command=self.cancel_selected_jobs)
+        self.cancel_button.pack(pady=5)
+
+        # Progress bar of the selected job, or of the most recent one
         self.progress_bar = ttk.Progressbar(root, orient="horizontal", length=300, mode="determinate")
         self.progress_bar.pack(pady=10)
 
@@ -34,17 +139,57 @@ class UspkgApp:
         self.status_label = Label(root, text="", font=("Arial", 12))
         self.status_label.pack(pady=5)
 
+        self.job_rows = {}
+        self.runner = JobRunner(root, on_frame=self.refresh_jobs)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+
     def ask_directory(self, title):
         return filedialog.askdirectory(title=title)
 
     def ask_file(self, title, filetypes):
         return filedialog.askopenfilename(title=title, filetypes=filetypes)
 
-    def update_progress(self, percent):
-        """Update the progress bar."""
-        self.progress_bar['value'] = percent
-        self.status_label.config(text=f"Progress: {percent:.2f}%")
-        self.root.update_idletasks()
+    def start_job(self, name, func, on_done=None):
+        """Run a job in the background and add it to the job list."""
+        job = self.runner.submit(name, func, on_done)
+        self.job_rows[job] = self.job_list.insert("", "end", text=name, values=("0%", job.status))
+        return job
+
+    def refresh_jobs(self):
+        """Redraw the job list and progress bar. Called once per frame by the job runner."""
+        for job, row in self.job_rows.items():
+            values = (f"{job.percent:.0f}%", job.status)
+            if tuple(self.job_list.item(row, "values")) != values:
+                self.job_list.item(row, values=values)
+
+        selected = [job for job, row in self.job_rows.items() if row in self.job_list.selection()]
+        current = selected[0] if selected else next(reversed(list(self.job_rows)), None)
+        if current is None:
+            return
+        self.progress_bar['value'] = current.percent
+        if current.running:
+            self.status_label.config(text=f"{current.name}: {current.percent:.2f}%")
+        elif current.error:
+            self.status_label.config(text=f"{current.name}: {current.status} ({current.error})")
+        else:
+            self.status_label.config(text=f"{current.name}: {current.status}")
+
+    def cancel_selected_jobs(self):
+        """Cancel the selected jobs, or every running job when none is selected."""
+        selection = self.job_list.selection()
+        for job, row in self.job_rows.items():
+            if job.running and (not selection or row in selection):
+                job.cancel()
+
+    def on_close(self):
+        # Let cancelled jobs remove their partial output before the window goes away.
+        running = [job for job in self.runner.jobs if job.running]
+        if not running:
+            self.root.destroy()
+            return
+        for job in running:
+            job.cancel()
+        self.root.after(100, self.on_close)
 
     def create_uspkg(self):
         folder = self.ask_directory("Select Folder to Package")
@@ -57,11 +202,11 @@ class UspkgApp:
 
         title = simpledialog.askstring("Input", "Enter Package Title:")
         description = simpledialog.askstring("Input", "Enter Package Description:")
-        
+
         # Create a new window for selecting the type
         type_window = tk.Toplevel(self.root)
         type_window.title("Select Package Type")
-        
+
         tk.Label(type_window, text="Select Package Style:").pack(pady=5)
         type_var = tk.StringVar()
         type_dropdown = ttk.Combobox(type_window, textvariable=type_var)
@@ -95,24 +240,20 @@ class UspkgApp:
                 if not image_file:
                     return
 
-                # Reset progress bar and status label
-                self.progress_bar['value'] = 0
-                self.status_label.config(text="")
+                def create_package(update_progress_callback):
+                    uspkg.create_encrypted_uspkg_with_uid(
+                        folder, output_file, title, description, image_file, _type, main_exe,
+                        update_progress_callback=update_progress_callback
+                    )
 
-                def create_package():
-                    try:
-                        uspkg.create_encrypted_uspkg_with_uid(
-                            folder, output_file, title, description, image_file, _type, main_exe,
-                            update_progress_callback=self.update_progress
-                        )
+                def on_done(job):
+                    if job.status == "Done":
                         messagebox.showinfo("Success", f"USPkg file created: {output_file}")
-                    except ValueError as e:
-                        messagebox.showerror("Error", f"Failed to create package: {e}")
-                    except Exception as e:
-                        messagebox.showerror("Error", f"An unexpected error occurred: {e}")
+                    elif job.status == "Failed":
+                        messagebox.showerror("Error", f"Failed to create package: {job.error}")
 
-                # Start creating the package in a separate thread
-                Thread(target=create_package).start()
+                # Create the package in the background; a cancelled build removes its partial output
+                self.start_job(f"Create {os.path.basename(output_file)}", create_package, on_done)
 
         # Add a button to browse for the executable
         ttk.Button(exe_window, text="Browse", command=browse_executable).pack(pady=10)
@@ -126,11 +267,17 @@ class UspkgApp:
         if not output_dir:
             return
 
-        try:
-            uspkg.extract_encrypted_uspkg_with_uid(uspkg_file, output_dir)
-            messagebox.showinfo("Success", f"Files extracted to: {output_dir}")
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to extract package: {e}")
+        def extract_package(update_progress_callback):
+            # Cancelling stops within the current file; _extract then removes the files it created.
+            _uspkg._extract(uspkg_file, output_dir, update_progress_callback)
+
+        def on_done(job):
+            if job.status == "Done":
+                messagebox.showinfo("Success", f"Files extracted to: {output_dir}")
+            elif job.status == "Failed":
+                messagebox.showerror("Error", f"Failed to extract package: {job.error}")
+
+        self.start_job(f"Extract {os.path.basename(uspkg_file)}", extract_package, on_done)
 
     def preview_uspkg(self):
         uspkg_file = self.ask_file("Select .uspkg File", [("USPkg files", "*.uspkg")])
@@ -138,54 +285,68 @@ class UspkgApp:
             return
 
         try:
-            # Create a new window for preview
-            preview_window = tk.Toplevel(self.root)
-            preview_window.title("USPkg Preview")
+            # Only the trailer is read here, so the preview opens at once whatever the package size
+            _, metadata = uspkg.read_uspkg_trailer(uspkg_file)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to preview package: {e}")
+            return
 
-            # Status label for verification
-            status_label = Label(preview_window, text="Verifying package...", font=("Arial", 12))
-            status_label.pack(pady=5)
+        # Create a new window for preview
+        preview_window = tk.Toplevel(self.root)
+        preview_window.title("USPkg Preview")
 
-            # First, verify the package
-            is_valid = uspkg.verify_uspkg_file(uspkg_file)
-            if is_valid:
-                status_label.config(text="Verification Status: Package is valid", fg="green")
-            else:
-                status_label.config(text="Verification Status: Package is invalid", fg="red")
-                return  # Stop if the package is invalid
+        # Status label for verification, updated when the background verification finishes
+        status_label = Label(preview_window, text="Verifying package...", font=("Arial", 12))
+        status_label.pack(pady=5)
+
+        # Title and description in new window
+        title_label = Label(preview_window, text=f"Package Title: {metadata.get('title', 'N/A')}", font=("Arial", 12))
+        title_label.pack(pady=5)
 
-            # If valid, proceed to read metadata
-            _, _, metadata = uspkg.read_uspkg_metadata(uspkg_file)
+        description_label = Label(preview_window, text=f"Package Description: {metadata.get('description', 'N/A')}", font=("Arial", 10))
+        description_label.pack(pady=5)
 
-            # Title and description in new window
-            title_label = Label(preview_window, text=f"Package Title: {metadata.get('title', 'N/A')}", font=("Arial", 12))
-            title_label.pack(pady=5)
+        # Image in new window
+        image_label = Label(preview_window)
+        image_label.pack(pady=5)
 
-            description_label = Label(preview_window, text=f"Package Description: {metadata.get('description', 'N/A')}", font=("Arial", 10))
-            description_label.pack(pady=5)
+        image_data = uspkg.get_image_data(metadata)
+        if image_data:
+            image = Image.open(io.BytesIO(image_data))
+            image.thumbnail((300, 300))  # Older packages have no thumbnail, so resize the full image
+            photo = ImageTk.PhotoImage(image)
 
-            # Image in new window
-            image_label = Label(preview_window)
-            image_label.pack(pady=5)
+            # Display the image in the new window
+            image_label.config(image=photo)
+            image_label.image = photo  # Keep a reference to prevent garbage collection
+        else:
+            image_label.config(text="No image available")
 
-            if metadata.get("image"):
-                image_data = base64.b64decode(metadata["image"])
-                image = Image.open(io.BytesIO(image_data))
-                image.thumbnail((300, 300))  # Resize the image for display
-                photo = ImageTk.PhotoImage(image)
+        def verify_package(update_progress_callback):
+            _uspkg._verify_uspkg(uspkg_file, update_progress_callback=update_progress_callback)
 
-                # Display the image in the new window
-                image_label.config(image=photo)
-                image_label.image = photo  # Keep a reference to prevent garbage collection
+        def on_done(job):
+            if not status_label.winfo_exists():
+                return
+            if job.status == "Done":
+                status_label.config(text="Verification Status: Package is valid", fg="green")
+            elif job.status == "Failed":
+                status_label.config(text=f"Verification Status: Package is invalid ({job.error})", fg="red")
             else:
-                image_label.config(text="No image available")
+                status_label.config(text="Verification Status: Cancelled")
 
-            # Close button
-            close_button = ttk.Button(preview_window, text="Close", command=preview_window.destroy)
-            close_button.pack(pady=10)
+        job = self.start_job(f"Verify {os.path.basename(uspkg_file)}", verify_package, on_done)
 
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to preview package: {e}")
+        def close_preview():
+            # Closing the preview stops its verification
+            job.cancel()
+            preview_window.destroy()
+
+        preview_window.protocol("WM_DELETE_WINDOW", close_preview)
+
+        # Close button
+        close_button = ttk.Button(preview_window, text="Close", command=close_preview)
+        close_button.pack(pady=10)
 
 
 # Run the application
@@ -198,4 +359,4 @@ if __name__ == "__main__":
 def main():
     root = tk.Tk()
     app = UspkgApp(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()